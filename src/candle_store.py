@@ -0,0 +1,247 @@
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from filelock import FileLock
+from config import CANDLE_STORE_DIR, CANDLE_INGEST_SETTINGS
+from market_cache import INTERVAL_SECONDS
+
+CANDLE_COLUMNS = ["timestamp", "open", "high", "low", "close", "volume", "turnover"]
+# ترتیب فیلدهای کندل در API و فایل‌های خروجی کوکوین
+KUCOIN_FIELD_ORDER = ["timestamp", "open", "close", "high", "low", "volume", "turnover"]
+
+CANDLE_SCHEMA = pa.schema(
+    [('timestamp', pa.int64())] + [(name, pa.float64()) for name in CANDLE_COLUMNS[1:]]
+)
+
+def partition_path(symbol, interval, year):
+    """Parquet file holding one symbol/interval/year of candles"""
+    return os.path.join(CANDLE_STORE_DIR, interval, symbol, f"{year}.parquet")
+
+def _year_of(timestamps):
+    if not isinstance(timestamps, pd.Series):
+        timestamps = pd.Series(timestamps)
+    return pd.to_datetime(timestamps, unit='s').dt.year
+
+def write_candles(symbol, interval, df):
+    """Merge candles into the store, deduplicating overlapping timestamps.
+
+    ``df`` needs CANDLE_COLUMNS with ``timestamp`` in epoch seconds. Incoming
+    rows win over stored rows with the same timestamp. Returns the number of
+    incoming rows.
+    """
+    if df.empty:
+        return 0
+    df = df[CANDLE_COLUMNS]
+    written = 0
+    for year, part in df.groupby(_year_of(df['timestamp'])):
+        path = partition_path(symbol, interval, year)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with FileLock(f"{path}.lock"):
+            incoming = len(part)
+            if os.path.exists(path):
+                part = pd.concat([pq.read_table(path).to_pandas(), part], ignore_index=True)
+            part = part.drop_duplicates(subset='timestamp', keep='last').sort_values('timestamp')
+            table = pa.Table.from_pandas(part, schema=CANDLE_SCHEMA, preserve_index=False)
+            tmp_path = f"{path}.tmp"
+            pq.write_table(table, tmp_path, compression='zstd')
+            os.replace(tmp_path, path)
+            written += incoming
+    return written
+
+def read_candles(symbol, interval, start=None, end=None, columns=None):
+    """Read stored candles for [start, end] (epoch seconds), oldest first"""
+    directory = os.path.join(CANDLE_STORE_DIR, interval, symbol)
+    if not os.path.isdir(directory):
+        return pd.DataFrame(columns=columns or CANDLE_COLUMNS)
+    first_year = _year_of([start])[0] if start is not None else None
+    last_year = _year_of([end])[0] if end is not None else None
+    frames = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.parquet'):
+            continue
+        year = int(name.split('.')[0])
+        if (first_year is not None and year < first_year) or (last_year is not None and year > last_year):
+            continue
+        filters = []
+        if start is not None:
+            filters.append(('timestamp', '>=', int(start)))
+        if end is not None:
+            filters.append(('timestamp', '<=', int(end)))
+        frames.append(pq.read_table(os.path.join(directory, name), columns=columns,
+                                    filters=filters or None).to_pandas())
+    if not frames:
+        return pd.DataFrame(columns=columns or CANDLE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+# ----- Bulk ingest -----
+
+def _iter_sources(path):
+    """Yield (member name, file object or path) for a plain, compressed or zipped CSV"""
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if member.endswith('/'):
+                    continue
+                with archive.open(member) as handle:
+                    yield member, handle
+    else:
+        yield os.path.basename(path), path
+
+def infer_symbol(name):
+    """Symbol from a file name like BTC-USDT_30min_2024.csv.gz or BTCUSDT-30m.zip"""
+    match = re.search(r"([A-Z0-9]+)-?(USDT|USDC|BTC|ETH)", os.path.basename(name).upper())
+    return f"{match.group(1)}-{match.group(2)}" if match else None
+
+def _read_chunks(source, column_map, chunk_rows):
+    """Stream a CSV source as chunks with CANDLE_COLUMNS (timestamp in seconds)"""
+    if column_map:
+        reader = pd.read_csv(source, usecols=list(column_map.values()), chunksize=chunk_rows,
+                             compression='infer' if isinstance(source, str) else None)
+        rename = {source_name: name for name, source_name in column_map.items()}
+    else:
+        # بدون نگاشت، ترتیب فیلدهای کوکوین فرض می‌شود و سطر عنوان (در صورت وجود) حذف می‌شود
+        reader = pd.read_csv(source, header=None, names=KUCOIN_FIELD_ORDER, chunksize=chunk_rows,
+                             compression='infer' if isinstance(source, str) else None)
+        rename = {}
+    for chunk in reader:
+        chunk = chunk.rename(columns=rename)
+        if 'turnover' not in chunk:
+            chunk['turnover'] = float('nan')
+        chunk = chunk[CANDLE_COLUMNS].apply(pd.to_numeric, errors='coerce').dropna(subset=['timestamp'])
+        timestamps = chunk['timestamp'].astype('int64')
+        # مهرهای زمانی میلی‌ثانیه‌ای به ثانیه تبدیل می‌شوند
+        chunk['timestamp'] = timestamps.where(timestamps < 10 ** 11, timestamps // 1000)
+        yield chunk
+
+def _stage(staging, staged, target, frames):
+    """Write buffered rows to a staging Parquet file; merged into the store only after validation"""
+    path = os.path.join(staging, f"{len(staged)}.parquet")
+    table = pa.Table.from_pandas(pd.concat(frames)[CANDLE_COLUMNS], schema=CANDLE_SCHEMA, preserve_index=False)
+    pq.write_table(table, path)
+    staged.append((target, path))
+
+def ingest_file(path, interval, symbol=None, column_map=None, chunk_rows=None):
+    """Stream one archive into the candle store.
+
+    Timestamps must be monotonic (ascending or descending) across the whole
+    file, except that rows may step back onto candles already read from it
+    (as in overlapping exports); such rows count as duplicates and are
+    merged. Misaligned rows are dropped. Rows are staged per year and merged
+    into the store only after the whole archive validates, so a rejected
+    file leaves the store untouched. Memory is
+    bounded by one chunk, the rows of the year being filled and one byte per
+    interval the file spans.
+    Returns a summary dict.
+    """
+    chunk_rows = chunk_rows or CANDLE_INGEST_SETTINGS['chunk_rows']
+    step = INTERVAL_SECONDS[interval]
+    summary = {'file': path, 'rows': 0, 'written': 0, 'misaligned': 0, 'duplicates': 0}
+    os.makedirs(CANDLE_STORE_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.ingest-', dir=CANDLE_STORE_DIR)
+    staged = []
+    try:
+        for name, source in _iter_sources(path):
+            target = symbol or infer_symbol(name) or infer_symbol(path)
+            if not target:
+                raise ValueError(f"Cannot infer symbol for {name}; pass --symbol")
+            direction = 0
+            first_ts = reached_slot = None
+            seen = np.zeros(0, dtype=bool)   # کندل‌های خوانده‌شده، یک خانه برای هر بازه از اولین ردیف
+            buffer, buffer_year = [], None
+            for chunk in _read_chunks(source, column_map, chunk_rows):
+                summary['rows'] += len(chunk)
+                aligned = chunk['timestamp'] % step == 0
+                summary['misaligned'] += int((~aligned).sum())
+                chunk = chunk[aligned]
+                if chunk.empty:
+                    continue
+
+                timestamps = chunk['timestamp'].to_numpy(dtype=np.int64)
+                if first_ts is None:
+                    first_ts = int(timestamps[0])
+                if direction == 0:
+                    moved = timestamps[timestamps != first_ts]
+                    if len(moved):
+                        direction = 1 if moved[0] > first_ts else -1
+                # با ضرب در جهت، فایل نزولی هم مثل فایل صعودی بررسی می‌شود
+                sign = direction or 1
+                slots = (timestamps - first_ts) * sign // step
+                start = reached_slot if reached_slot is not None else slots[0] - 1
+                behind = slots <= np.maximum.accumulate(np.concatenate(([start], slots)))[:-1]
+                # برگشت فقط روی کندلی مجاز است که قبلاً در همین فایل خوانده شده باشد
+                known = (slots >= 0) & (slots < len(seen))
+                earlier = pd.Series(slots).duplicated().to_numpy(copy=True)
+                earlier[known] |= seen[slots[known]]
+                reordered = behind & ~earlier
+                if reordered.any():
+                    raise ValueError(f"Non-monotonic timestamps in {name} near {int(timestamps[reordered.argmax()])}")
+                summary['duplicates'] += int(earlier.sum())
+                reached_slot = int(max(start, slots.max()))
+                if reached_slot >= len(seen):
+                    seen = np.concatenate((seen, np.zeros(max(reached_slot + 1, 2 * len(seen)) - len(seen), dtype=bool)))
+                seen[slots] = True
+
+                for year, part in chunk.groupby(_year_of(chunk['timestamp']), sort=False):
+                    if buffer_year is not None and year != buffer_year:
+                        _stage(staging, staged, target, buffer)
+                        buffer = []
+                    buffer_year = year
+                    buffer.append(part)
+            if buffer:
+                _stage(staging, staged, target, buffer)
+            summary['symbol'] = target
+
+        # کل فایل معتبر است؛ حالا سال‌های آماده‌شده در مخزن ادغام می‌شوند
+        for target, staged_path in staged:
+            summary['written'] += write_candles(target, interval, pq.read_table(staged_path).to_pandas())
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return summary
+
+def parse_column_map(text):
+    """'timestamp=open_time,open=o,...' -> dict of store column -> source column"""
+    if not text:
+        return None
+    mapping = dict(item.split('=', 1) for item in text.split(','))
+    missing = [name for name in CANDLE_COLUMNS[:-1] if name not in mapping]
+    if missing:
+        raise ValueError(f"Column map missing: {', '.join(missing)}")
+    return mapping
+
+def ingest_files(paths, interval, symbol=None, column_map=None, workers=None):
+    """Ingest archives in parallel worker processes, one file per task"""
+    workers = workers or CANDLE_INGEST_SETTINGS['workers']
+    started = time.time()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(ingest_file, path, interval, symbol, column_map): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+                results.append(summary)
+                print(f"Ingested {summary['file']} ({summary.get('symbol')}): {summary['rows']} rows, "
+                      f"{summary['misaligned']} misaligned, {summary['duplicates']} duplicates")
+            except Exception as e:
+                print(f"Error ingesting {futures[future]}: {e}")
+    print(f"Ingested {len(results)}/{len(paths)} files in {time.time() - started:.1f}s")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Bulk import compressed candle archives into the local candle store')
+    parser.add_argument('files', nargs='+', help='CSV, CSV.GZ/BZ2/XZ or ZIP files')
+    parser.add_argument('--interval', default='30min', choices=sorted(INTERVAL_SECONDS))
+    parser.add_argument('--symbol', help='Symbol for all files (default: inferred from file names)')
+    parser.add_argument('--columns', help="Header mapping, e.g. 'timestamp=open_time,open=o,high=h,low=l,close=c,volume=v'")
+    parser.add_argument('--workers', type=int, help='Parallel worker processes')
+    args = parser.parse_args()
+
+    ingest_files(args.files, args.interval, args.symbol, parse_column_map(args.columns), args.workers)
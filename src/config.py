@@ -1,3 +1,5 @@
+import os
+
 # لیست ارزهای دیجیتال برای بررسی - نمادهای سازگار با KuCoin
 CRYPTOCURRENCIES = [
     "BTC-USDT", "ETH-USDT", "BNB-USDT", "SOL-USDT", "XRP-USDT",
@@ -78,3 +80,103 @@ KUCOIN_BASE_URL = "https://api.kucoin.com"
 KUCOIN_KLINE_ENDPOINT = "/api/v1/market/candles"
 KUCOIN_TICKER_ENDPOINT = "/api/v1/market/orderbook/level1"
 KUCOIN_STATS_ENDPOINT = "/api/v1/market/stats"
+
+# تنظیمات خروجی تحلیلی (Parquet)
+ANALYTICS_DIR = "data/analytics"
+ANALYTICS_SIGNALS_DATASET = f"{ANALYTICS_DIR}/signals"
+ANALYTICS_MANIFEST_FILE = f"{ANALYTICS_DIR}/manifest.json"
+
+# تنظیمات کش مشترک داده‌های بازار
+MARKET_CACHE_FILE = "data/cache/market_cache.json"
+MARKET_CACHE_TTLS = {
+    'stats': 120,   # آمار ۲۴ ساعته
+    'ticker': 10,   # قیمت لحظه‌ای
+    'kline': 60,    # انتهای باز سری کندل‌ها
+}
+MARKET_CACHE_MAX_ENTRIES = 2000
+MARKET_CACHE_MAX_CANDLES = 1500
+MARKET_CACHE_KEEP_CANDLES = KLINE_SIZE + 100   # کندل‌های قدیمی‌تر از این تعداد کندل از کش حذف می‌شوند
+
+# تنظیمات زمان‌بندی اولویت‌دار نمادها
+SCAN_STATE_FILE = "data/scan_state.json"
+SCHEDULER_SETTINGS = {
+    'scan_budget_seconds': 900,     # سقف زمان هر اسکن
+    'hot_fraction': 0.3,            # نمادهای داغ: هر کندل
+    'warm_fraction': 0.4,
+    'warm_every': 2,                # هر ۲ کندل
+    'cold_every': 4,                # هر ۴ کندل
+    'volatility_scale': 0.02,       # ATR/قیمت در این مقدار امتیاز کامل می‌گیرد
+    'volume_change_scale': 1.3,
+    'level_distance_scale': 0.02,   # فاصله نسبی تا باند بولینگر/حمایت/مقاومت
+    'weights': {'volatility': 0.35, 'volume': 0.2, 'proximity': 0.3, 'hit_rate': 0.15},
+}
+
+# تنظیمات هرس بر اساس کران بالای امتیاز
+PRUNING_SETTINGS = {
+    'enabled': True,
+    'max_state_age_seconds': 24 * 3600,   # وضعیت ذخیره‌شده قدیمی‌تر از این استفاده نمی‌شود
+}
+
+# تایم فریم پیگیری وضعیت سیگنال‌ها
+TRACKER_TIMEFRAME = "30min"
+
+# سرویس محلی پرس‌وجوی وضعیت بازار (اختیاری)
+QUERY_SERVICE_SETTINGS = {
+    'enabled': os.environ.get('MARKET_STATE_SERVICE') == '1',
+    'host': '127.0.0.1',
+    'port': int(os.environ.get('MARKET_STATE_PORT', 8765)),
+}
+
+# کرنل‌های کامپایل‌شده با Numba (در صورت نصب بودن)
+JIT_SETTINGS = {
+    'enabled': os.environ.get('DISABLE_JIT') != '1',
+    'cache_dir': "data/cache/numba",
+}
+
+# ذخیره‌سازی محلی کندل‌های تاریخی
+CANDLE_STORE_DIR = "data/candles"
+CANDLE_INGEST_SETTINGS = {
+    'chunk_rows': 200000,
+    'workers': os.cpu_count() or 2,
+}
+
+# کش همبستگی بازده‌ها برای ادغام سیگنال‌های هم‌جهت نمادهای همبسته
+CORRELATION_CACHE_FILE = "data/cache/correlation.json"
+CORRELATION_SETTINGS = {
+    'enabled': True,
+    'window': 96,          # تعداد بازده‌های اخیر هر نماد (۲ روز در تایم فریم ۳۰ دقیقه)
+    'min_periods': 48,     # حداقل بازده‌های مشترک برای محاسبه همبستگی
+    'threshold': 0.8,      # نمادهای با همبستگی بیشتر در یک خوشه قرار می‌گیرند
+    'flush_every_symbols': 10,  # سیگنال‌های در صف پس از این تعداد نماد ارسال می‌شوند
+    'flush_seconds': 60,        # یا پس از این مدت، هر کدام زودتر برسد
+}
+
+# منابع داده بازار؛ اولین منبع اصلی است و بقیه (آینه‌ها یا صرافی‌های دیگر) پشتیبان
+MARKET_DATA_PROVIDERS = [
+    {'name': 'kucoin', 'type': 'kucoin', 'base_url': KUCOIN_BASE_URL},
+] + [
+    {'name': f"kucoin-mirror-{i + 1}", 'type': 'kucoin', 'base_url': url.strip()}
+    for i, url in enumerate(filter(None, os.environ.get('KUCOIN_MIRROR_URLS', '').split(',')))
+]
+MARKET_DATA_SETTINGS = {
+    'timeout': 10,                # سقف زمان هر درخواست
+    'max_attempts': 3,            # حداکثر درخواست‌ها (شامل درخواست‌های موازی) برای هر فراخوانی
+    'hedging': True,              # ارسال درخواست تکراری پس از تأخیر p95
+    'hedge_default_delay': 1.0,   # تأخیر پیش از جمع شدن نمونه‌های کافی
+    'hedge_min_delay': 0.05,
+    'hedge_max_delay': 3.0,
+    'latency_window': 200,        # تعداد نمونه‌های زمان پاسخ برای هر منبع
+    'min_latency_samples': 20,
+    'failure_threshold': 5,       # خطاهای پیاپی تا باز شدن مدارشکن
+    'open_seconds': 30,           # مدت باز ماندن مدارشکن پیش از درخواست آزمایشی
+    'workers': 16,
+}
+
+# ذخیره وضعیت به صورت اسنپ‌شات فشرده پایه + بخش‌های تغییرات (به جای JSON کامل در هر اجرا)
+STATE_DIR = "data/state"
+SIGNALS_STATE_FILE = f"{STATE_DIR}/signals.state.gz"
+SCAN_STATE_SNAPSHOT_FILE = f"{STATE_DIR}/scan_state.state.gz"
+STATE_SETTINGS = {
+    'max_segments': 48,         # حداکثر بخش‌های تغییرات پیش از فشرده‌سازی مجدد
+    'max_delta_ratio': 0.5,     # فشرده‌سازی وقتی حجم تغییرات از این نسبت حجم پایه بیشتر شود
+}
@@ -1,4 +1,3 @@
-import requests
 import pandas as pd
 import numpy as np
 import os
@@ -7,72 +6,58 @@ from datetime import datetime, timedelta
 import pytz
 import ta
 import traceback
+import kernels
+import argparse
 from config import *
 from signal_generator import generate_signals
 from telegram_sender import send_telegram_message
 from signal_tracker import save_signal, load_signals
+from market_cache import get_cache, INTERVAL_SECONDS
+from market_data import get_client, request_kline_rows
+from symbol_scheduler import (load_scan_state, save_scan_state, plan_scan,
+                              mark_scanned, extract_metrics, metrics_from_row, record_scan)
+from score_pruning import capture_prune_state, can_prune
+from market_state import market_state, start_query_service
+from signal_correlation import CorrelationCache, collapse_correlated
 
 def fetch_kline_data(symbol, size=100, interval="30min"):
-    """Fetch kline data from KuCoin with retry"""
-    url = f"{KUCOIN_BASE_URL}{KUCOIN_KLINE_ENDPOINT}"
+    """Fetch kline data from KuCoin, reusing cached closed candles"""
     end_time = int(time.time())
-    interval_seconds = 1800 if interval == "30min" else 3600
-    start_time = end_time - (size * interval_seconds)
-    
-    params = {"symbol": symbol, "type": interval, "startAt": start_time, "endAt": end_time}
-    for attempt in range(3):
-        try:
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            if not data.get('data'):
-                print(f"Error fetching data for {symbol} on {interval}: {data}")
-                return None
-            df = pd.DataFrame(data['data'], columns=[
-                "timestamp", "open", "close", "high", "low", "volume", "turnover"
-            ])
-            df = df[["timestamp", "open", "high", "low", "close", "volume"]]
-            df = df.astype(float)
-            df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
-            df = df.iloc[::-1].reset_index(drop=True)
-            print(f"Received {len(df)} candles for {symbol} on {interval}")
-            return df
-        except Exception as e:
-            print(f"Attempt {attempt + 1} failed for {symbol} on {interval}: {e}")
-            time.sleep(2 ** attempt)
-    return None
+    start_time = end_time - (size * INTERVAL_SECONDS[interval])
+
+    rows = get_cache().candles(
+        symbol, interval, start_time, end_time,
+        lambda start, end: request_kline_rows(symbol, interval, start, end)
+    )
+    if not rows:
+        return None
+    df = pd.DataFrame(rows, columns=[
+        "timestamp", "open", "close", "high", "low", "volume", "turnover"
+    ])
+    df = df[["timestamp", "open", "high", "low", "close", "volume"]]
+    df = df.astype(float)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
+    df = df.iloc[::-1].reset_index(drop=True)
+    print(f"Received {len(df)} candles for {symbol} on {interval}")
+    return df
+
+def request_volume_data(symbol):
+    """Request 24h stats from the market data providers"""
+    return get_client().stats_24h(symbol)
 
 def fetch_volume_data(symbol):
     """Fetch 24h trading volume from KuCoin"""
-    url = f"{KUCOIN_BASE_URL}{KUCOIN_STATS_ENDPOINT}"
-    params = {"symbol": symbol}
-    try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        volume = float(data.get('data', {}).get('volValue', 0))
-        print(f"24h volume for {symbol}: {volume} USDT")
-        return volume
-    except Exception as e:
-        print(f"Error fetching volume for {symbol}: {e}")
-        return 0
-
-def check_trend_consistency(trend_series):
-    """Check trend consistency in the time window"""
-    if len(trend_series) == 0:
-        return 'neutral'
-    if all(trend == 'up' for trend in trend_series):
-        return 'up'
-    if all(trend == 'down' for trend in trend_series):
-        return 'down'
-    return 'neutral'
+    stats = get_cache().get_or_fetch('stats', {"symbol": symbol}, lambda: request_volume_data(symbol))
+    volume = float((stats or {}).get('volValue') or 0)
+    print(f"24h volume for {symbol}: {volume} USDT")
+    return volume
 
 def prepare_dataframe(df, timeframe=PRIMARY_TIMEFRAME):
     """Add technical indicators and price action rules"""
     if df is None or len(df) < SCALPING_SETTINGS['trend_confirmation_window']:
         return None
     try:
-        df['rsi'] = ta.momentum.RSIIndicator(df['close'], window=SCALPING_SETTINGS['rsi_period']).rsi()
+        df['rsi'] = kernels.rsi(df['close'].to_numpy(), SCALPING_SETTINGS['rsi_period'])
         df['ema_short'] = ta.trend.ema_indicator(df['close'], window=SCALPING_SETTINGS['ema_short'])
         df['ema_medium'] = ta.trend.ema_indicator(df['close'], window=SCALPING_SETTINGS['ema_medium'])
         df['ema_long'] = ta.trend.ema_indicator(df['close'], window=SCALPING_SETTINGS['ema_long'])
@@ -92,9 +77,7 @@ def prepare_dataframe(df, timeframe=PRIMARY_TIMEFRAME):
         df['bb_middle'] = bollinger.bollinger_mavg()
         df['bb_lower'] = bollinger.bollinger_lband()
 
-        df['atr'] = ta.volatility.AverageTrueRange(
-            high=df['high'], low=df['low'], close=df['close'], window=14
-        ).average_true_range()
+        df['atr'] = kernels.atr(df['high'].to_numpy(), df['low'].to_numpy(), df['close'].to_numpy(), window=14)
 
         df['volume_change'] = df['volume'].pct_change()
         df['price_change'] = df['close'].pct_change()
@@ -102,15 +85,9 @@ def prepare_dataframe(df, timeframe=PRIMARY_TIMEFRAME):
         df['support'] = df['low'].rolling(window=10).min()
         df['trend'] = np.where(df['ema_short'] > df['ema_long'], 'up', 'down')
 
-        window = SCALPING_SETTINGS['trend_confirmation_window']
-        trend_confirmed = []
-        for i in range(len(df)):
-            if i < window - 1:
-                trend_confirmed.append('neutral')
-            else:
-                trend_slice = df['trend'].iloc[i - window + 1:i + 1]
-                trend_confirmed.append(check_trend_consistency(trend_slice))
-        df['trend_confirmed'] = trend_confirmed
+        df['trend_confirmed'] = kernels.trend_confirmed(
+            (df['trend'] == 'up').to_numpy(), SCALPING_SETTINGS['trend_confirmation_window']
+        )
         return df
     except Exception as e:
         print(f"Error preparing DataFrame for {timeframe}: {e}")
@@ -122,14 +99,83 @@ def generate_tradingview_link(symbol):
     tradingview_symbol = symbol.replace('-', '')
     return f"https://www.tradingview.com/chart/?symbol=KUCOIN:{tradingview_symbol}"
 
-def main():
+def format_signal_message(signal):
+    """Telegram message for a generated signal"""
+    tradingview_link = generate_tradingview_link(signal['symbol'])
+    return (
+        f"🚨 Signal {signal['type']} for {signal['symbol']}\n\n"
+        f"💰 Current Price: {signal['current_price']}\n"
+        f"🎯 Target Price: {signal['target_price']}\n"
+        f"🛑 Stop Loss: {signal['stop_loss']}\n"
+        f"📊 Signal Score: {signal['score']}\n"
+        f"📊 Risk/Reward Ratio: {signal['risk_reward_ratio']:.2f}\n\n"
+        f"📊 Reasons:\n{signal['reasons']}\n\n"
+        f"📈 View Chart: {tradingview_link}\n"
+        f"⏱️ Time: {signal['time']}"
+    )
+
+def flush_signals(pending, sent, correlations, all_signals, publish=False):
+    """Send queued signals after collapsing them against each other and against ``sent``.
+
+    Delivered signals are saved and appended to ``sent``; returns the
+    collapsed signals.
+    """
+    if correlations is not None:
+        to_send, collapsed = collapse_correlated(pending, correlations, sent=sent)
+        if collapsed:
+            print(f"Collapsed {len(collapsed)} correlated signals: {', '.join(s['symbol'] for s in collapsed)}")
+    else:
+        to_send, collapsed = pending, []
+
+    for signal in to_send:
+        if send_telegram_message(format_signal_message(signal)):
+            save_signal(signal)
+            all_signals.append(signal)
+            sent.append(signal)
+            if publish:
+                market_state.update_signals(all_signals)
+            print(f"Signal sent and saved for {signal['symbol']}: {signal['type']}")
+        else:
+            print(f"Failed to send signal for {signal['symbol']}")
+    return collapsed
+
+def main(service=None):
     print("🚀 Starting cryptocurrency analysis...")
-    signals_sent = 0
     tehran_tz = pytz.timezone('Asia/Tehran')
-    active_signals = {s['symbol']: s for s in load_signals() if s['status'] == 'active'}
+    all_signals = load_signals()
+    active_signals = {s['symbol']: s for s in all_signals if s['status'] == 'active'}
+
+    scan_state = load_scan_state()
+    started_at = time.time()
+    deadline = time.monotonic() + SCHEDULER_SETTINGS['scan_budget_seconds']
+    scan_order, deferred = plan_scan(CRYPTOCURRENCIES, scan_state, all_signals, now=started_at)
+    scanned, skipped, pruned = [], [], []
+    correlations = CorrelationCache() if CORRELATION_SETTINGS['enabled'] else None
+    pending_signals, sent_signals, collapsed = [], [], []
+    flushed_index, flushed_at = 0, time.monotonic()
+    # وضعیت بازار فقط وقتی سرویس پرس‌وجو در حال اجراست منتشر می‌شود
+    publish = service is not None
+    if publish:
+        market_state.set_universe(CRYPTOCURRENCIES)
+        market_state.update_signals(all_signals)
+        market_state.update_meta(scan_started_at=started_at, scan_finished_at=None,
+                                 planned=len(scan_order), deferred=len(deferred))
 
-    for crypto in CRYPTOCURRENCIES:
+    for index, crypto in enumerate(scan_order):
+        # سیگنال‌ها دسته‌ای ارسال می‌شوند تا تأخیر ارسال به اندازه یک دسته محدود بماند، نه کل اسکن
+        if (index - flushed_index >= CORRELATION_SETTINGS['flush_every_symbols']
+                or time.monotonic() - flushed_at >= CORRELATION_SETTINGS['flush_seconds']):
+            if pending_signals:
+                collapsed += flush_signals(pending_signals, sent_signals, correlations, all_signals, publish)
+                pending_signals = []
+            flushed_index, flushed_at = index, time.monotonic()
+        if time.monotonic() >= deadline:
+            skipped = scan_order[index:]
+            print(f"Scan budget exhausted, skipping {len(skipped)} symbols: {', '.join(skipped)}")
+            break
         print(f"Analyzing {crypto}...")
+        scanned.append(crypto)
+        mark_scanned(scan_state, crypto)
         try:
             trading_symbol = KUCOIN_SUPPORTED_PAIRS.get(crypto, crypto)
             if trading_symbol != crypto:
@@ -138,6 +184,7 @@ def main():
             volume_24h = fetch_volume_data(trading_symbol)
             if volume_24h < SCALPING_SETTINGS['min_volume_threshold']:
                 print(f"Skipping {crypto} due to low 24h volume: {volume_24h}")
+                mark_scanned(scan_state, crypto, low_volume=True)
                 continue
 
             if crypto in active_signals:
@@ -159,6 +206,22 @@ def main():
             df_primary = fetch_kline_data(trading_symbol, size=KLINE_SIZE, interval=PRIMARY_TIMEFRAME)
             if df_primary is None:
                 continue
+            if correlations is not None:
+                correlations.update(crypto, df_primary)
+
+            if PRUNING_SETTINGS['enabled']:
+                prune_state = scan_state['symbols'].get(crypto, {}).get('prune_state')
+                prunable, upper, latest = can_prune(prune_state, df_primary)
+                if prunable:
+                    print(f"Pruning {crypto}: score upper bounds buy={upper[0]} sell={upper[1]}")
+                    # معیارهای زمان‌بند از ردیف به‌روزشده همین اسکن، نه از آخرین اسکن کامل
+                    mark_scanned(scan_state, crypto, metrics=metrics_from_row(latest))
+                    # ردیف تایم فریم اصلی برای سرویس پرس‌وجو؛ کندل‌ها از قبل دریافت شده‌اند
+                    if publish:
+                        market_state.update_indicators(crypto, PRIMARY_TIMEFRAME,
+                                                       prepare_dataframe(df_primary, PRIMARY_TIMEFRAME))
+                    pruned.append(crypto)
+                    continue
 
             df_higher = fetch_kline_data(trading_symbol, size=KLINE_SIZE // 2, interval=HIGHER_TIMEFRAME)
             if df_higher is None:
@@ -168,28 +231,14 @@ def main():
             prepared_df_higher = prepare_dataframe(df_higher, HIGHER_TIMEFRAME)
             if prepared_df_primary is None or prepared_df_higher is None:
                 continue
+            mark_scanned(scan_state, crypto, metrics=extract_metrics(prepared_df_primary),
+                         prune_state=capture_prune_state(prepared_df_primary))
+            if publish:
+                market_state.update_indicators(crypto, PRIMARY_TIMEFRAME, prepared_df_primary)
+                market_state.update_indicators(crypto, HIGHER_TIMEFRAME, prepared_df_higher)
 
             last_row = prepared_df_primary.iloc[-1]
-            signals = generate_signals(prepared_df_primary, prepared_df_higher, crypto)
-            for signal in signals:
-                tradingview_link = generate_tradingview_link(signal['symbol'])
-                message = (
-                    f"🚨 Signal {signal['type']} for {signal['symbol']}\n\n"
-                    f"💰 Current Price: {signal['current_price']}\n"
-                    f"🎯 Target Price: {signal['target_price']}\n"
-                    f"🛑 Stop Loss: {signal['stop_loss']}\n"
-                    f"📊 Signal Score: {signal['score']}\n"
-                    f"📊 Risk/Reward Ratio: {signal['risk_reward_ratio']:.2f}\n\n"
-                    f"📊 Reasons:\n{signal['reasons']}\n\n"
-                    f"📈 View Chart: {tradingview_link}\n"
-                    f"⏱️ Time: {signal['time']}"
-                )
-                if send_telegram_message(message):
-                    signals_sent += 1
-                    save_signal(signal)
-                    print(f"Signal sent and saved for {crypto}: {signal['type']}")
-                else:
-                    print(f"Failed to send signal for {crypto}")
+            pending_signals.extend(generate_signals(prepared_df_primary, prepared_df_higher, crypto))
 
         except Exception as e:
             print(f"Error during analysis of {crypto}: {e}")
@@ -197,12 +246,45 @@ def main():
 
         time.sleep(0.5)
 
-    send_telegram_message(f"✅ Scan completed. {signals_sent} signals sent.", silent=True)
+    if correlations is not None:
+        correlations.save()
+    collapsed += flush_signals(pending_signals, sent_signals, correlations, all_signals, publish)
+    signals_sent = len(sent_signals)
+
+    record_scan(scan_state, started_at, scanned, deferred, skipped, pruned)
+    if publish:
+        market_state.update_meta(scan_finished_at=time.time(), scanned=len(scanned), skipped=len(skipped),
+                                 pruned=len(pruned), signals_sent=signals_sent)
+    save_scan_state(scan_state)
+    summary = f"✅ Scan completed. {signals_sent} signals sent."
+    if pruned:
+        print(f"Score pruning skipped {len(pruned)} symbols, saving {len(pruned)} kline requests")
+        summary += f" {len(pruned)} symbols pruned ({len(pruned)} kline requests saved)."
+    if skipped:
+        summary += f" {len(skipped)} symbols skipped (time budget)."
+    if collapsed:
+        summary += f" {len(collapsed)} correlated signals collapsed."
+    send_telegram_message(summary, silent=True)
     print(f"Analysis complete. {signals_sent} signals sent.")
+    print(f"Market cache: {get_cache().summary()}")
+    print(f"Market data: {get_client().summary()}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Scan cryptocurrencies and send signals')
+    parser.add_argument('--serve', action='store_true',
+                        help='Serve the latest indicators and signals on localhost and keep serving after the scan')
+    args = parser.parse_args()
+
+    service = start_query_service() if args.serve or QUERY_SERVICE_SETTINGS['enabled'] else None
     try:
-        main()
+        main(service)
     except Exception as e:
         print(f"Fatal error: {e}")
         send_telegram_message(f"❌ System error: {e}")
+    if service and args.serve:
+        print("Scan finished, market state service still running (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            service.shutdown()
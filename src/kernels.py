@@ -0,0 +1,179 @@
+import os
+import argparse
+import numpy as np
+from config import JIT_SETTINGS
+
+# کش کامپایل نامبا کنار کش داده‌های بازار تا اجراهای بعدی از ابتدا کامپایل نکنند
+os.environ.setdefault('NUMBA_CACHE_DIR', JIT_SETTINGS['cache_dir'])
+
+# ----- Loop kernels (compiled with Numba when available) -----
+
+def _trend_confirmed_loop(up, window):
+    """1 = up, -1 = down, 0 = neutral for each row of a boolean trend series"""
+    out = np.zeros(len(up), dtype=np.int8)
+    run_up = 0
+    run_down = 0
+    for i in range(len(up)):
+        if up[i]:
+            run_up += 1
+            run_down = 0
+        else:
+            run_down += 1
+            run_up = 0
+        if i >= window - 1:
+            if run_up >= window:
+                out[i] = 1
+            elif run_down >= window:
+                out[i] = -1
+    return out
+
+def _first_hit_loop(high, low, target, stop, is_buy):
+    """Index of the first candle reaching target (1) or stop (2), or (-1, 0)"""
+    for i in range(len(high)):
+        if is_buy:
+            if high[i] >= target:
+                return i, 1
+            if low[i] <= stop:
+                return i, 2
+        else:
+            if low[i] <= target:
+                return i, 1
+            if high[i] >= stop:
+                return i, 2
+    return -1, 0
+
+def _ewm_loop(values, com):
+    """pandas ewm(com=com, adjust=False).mean() recursion, step for step"""
+    alpha = 1.0 / (1.0 + com)
+    old_wt_factor = 1.0 - alpha
+    new_wt = alpha
+    out = np.empty(len(values))
+    weighted = values[0]
+    out[0] = weighted
+    for i in range(1, len(values)):
+        cur = values[i]
+        if weighted == weighted:
+            if cur == cur:
+                old_wt = old_wt_factor
+                if weighted != cur:
+                    weighted = old_wt * weighted + new_wt * cur
+                    weighted /= old_wt + new_wt
+        elif cur == cur:
+            weighted = cur
+        out[i] = weighted
+    return out
+
+def _wilder_atr_loop(true_range, window, seed):
+    """ta AverageTrueRange recursion: zeros, seed at window-1, then Wilder smoothing"""
+    atr = np.zeros(len(true_range))
+    if len(true_range) < window:
+        return atr
+    atr[window - 1] = seed
+    for i in range(window, len(atr)):
+        atr[i] = (atr[i - 1] * (window - 1) + true_range[i]) / float(window)
+    return atr
+
+# ----- NumPy fallbacks -----
+
+def _trend_confirmed_numpy(up, window):
+    counts = np.concatenate(([0], np.cumsum(up.astype(np.int64))))
+    out = np.zeros(len(up), dtype=np.int8)
+    if len(up) >= window:
+        window_sums = counts[window:] - counts[:-window]
+        tail = out[window - 1:]
+        tail[window_sums == window] = 1
+        tail[window_sums == 0] = -1
+    return out
+
+def _first_hit_numpy(high, low, target, stop, is_buy):
+    if is_buy:
+        target_hit, stop_hit = high >= target, low <= stop
+    else:
+        target_hit, stop_hit = low <= target, high >= stop
+    hits = target_hit | stop_hit
+    if not hits.any():
+        return -1, 0
+    index = int(np.argmax(hits))
+    return index, 1 if target_hit[index] else 2
+
+def _ewm_numpy(values, com):
+    import pandas as pd
+    return pd.Series(values).ewm(com=com, adjust=False).mean().to_numpy(copy=True)
+
+BACKEND = 'numpy'
+trend_confirmed_codes = _trend_confirmed_numpy
+first_hit = _first_hit_numpy
+ewm_adjust_false = _ewm_numpy
+wilder_atr = _wilder_atr_loop
+
+if JIT_SETTINGS['enabled']:
+    try:
+        import numba
+        trend_confirmed_codes = numba.njit(cache=True)(_trend_confirmed_loop)
+        first_hit = numba.njit(cache=True)(_first_hit_loop)
+        ewm_adjust_false = numba.njit(cache=True)(_ewm_loop)
+        wilder_atr = numba.njit(cache=True)(_wilder_atr_loop)
+        BACKEND = 'numba'
+    except ImportError:
+        pass
+
+# ----- Indicator wrappers shared by both backends -----
+
+def trend_confirmed(trend_up, window):
+    """'up'/'down' when the whole rolling window agrees, otherwise 'neutral'"""
+    codes = trend_confirmed_codes(np.ascontiguousarray(trend_up, dtype=np.bool_), window)
+    return np.where(codes == 1, 'up', np.where(codes == -1, 'down', 'neutral'))
+
+def rsi(close, window):
+    """Same values as ta.momentum.RSIIndicator(close, window).rsi()"""
+    close = np.asarray(close, dtype=np.float64)
+    diff = np.concatenate(([np.nan], np.diff(close)))
+    up = np.where(diff > 0, diff, 0.0)
+    down = -np.where(diff < 0, diff, 0.0)
+    ema_up = ewm_adjust_false(up, window - 1.0)
+    ema_down = ewm_adjust_false(down, window - 1.0)
+    ema_up[:window - 1] = np.nan
+    ema_down[:window - 1] = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(ema_down == 0, 100, 100 - (100 / (1 + ema_up / ema_down)))
+
+def atr(high, low, close, window=14):
+    """Same values as ta.volatility.AverageTrueRange(...).average_true_range()"""
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    prev_close = np.concatenate(([np.nan], close[:-1]))
+    true_range = np.fmax(np.fmax(high - low, np.abs(high - prev_close)), np.abs(low - prev_close))
+    seed = np.mean(true_range[:window]) if len(true_range) >= window else 0.0
+    return wilder_atr(true_range, window, seed)
+
+def _parity_check(rows=2000, seed=7):
+    """Compare compiled kernels against the NumPy fallbacks on random data"""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, rows)))
+    high = close * (1 + rng.uniform(0, 0.01, rows))
+    low = close * (1 - rng.uniform(0, 0.01, rows))
+    trend_up = rng.random(rows) < 0.7
+    cases = [
+        ('trend_confirmed', _trend_confirmed_loop, _trend_confirmed_numpy, trend_confirmed_codes, (trend_up, 10)),
+        ('first_hit', _first_hit_loop, _first_hit_numpy, first_hit, (high, low, close[0] * 1.3, close[0] * 0.8, True)),
+        ('first_hit_sell', _first_hit_loop, _first_hit_numpy, first_hit, (high, low, close[0] * 0.8, close[0] * 1.3, False)),
+        ('ewm', _ewm_loop, _ewm_numpy, ewm_adjust_false, (np.abs(np.diff(close, prepend=close[0])), 13.0)),
+        ('wilder_atr', _wilder_atr_loop, _wilder_atr_loop, wilder_atr, (high - low, 14, float(np.mean((high - low)[:14])))),
+    ]
+    ok = True
+    for name, loop, fallback, active, args in cases:
+        results = [np.asarray(f(*args)) for f in (loop, fallback, active)]
+        same = all(np.array_equal(results[0], r, equal_nan=True) for r in results[1:])
+        print(f"{name}: {'identical' if same else 'MISMATCH'}")
+        ok = ok and same
+    print(f"Active backend: {BACKEND}")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Indicator kernels')
+    parser.add_argument('--check', action='store_true', help='Verify backend parity (also warms the compile cache)')
+    args = parser.parse_args()
+    if args.check:
+        raise SystemExit(0 if _parity_check() else 1)
+    print(f"Active backend: {BACKEND}")
@@ -0,0 +1,208 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+from filelock import FileLock
+from config import (MARKET_CACHE_FILE, MARKET_CACHE_TTLS, MARKET_CACHE_MAX_ENTRIES, MARKET_CACHE_MAX_CANDLES,
+                    MARKET_CACHE_KEEP_CANDLES)
+
+# طول هر کندل به ثانیه برای تایم‌فریم‌های کوکوین
+INTERVAL_SECONDS = {
+    "1min": 60, "3min": 180, "5min": 300, "15min": 900, "30min": 1800,
+    "1hour": 3600, "2hour": 7200, "4hour": 14400, "6hour": 21600,
+    "8hour": 28800, "12hour": 43200, "1day": 86400, "1week": 604800,
+}
+
+class MarketCache:
+    """TTL + LRU cache for KuCoin responses, persisted atomically to disk.
+
+    Entries are keyed by endpoint and request parameters. Closed candles are
+    kept per (symbol, interval) series without expiry so only the newest
+    candles have to be requested again.
+    """
+
+    def __init__(self, path=MARKET_CACHE_FILE, ttls=None, max_entries=MARKET_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttls = dict(MARKET_CACHE_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self.stats = {}
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._load()
+
+    @staticmethod
+    def make_key(endpoint, params=None):
+        return f"{endpoint}?{urlencode(sorted((params or {}).items()))}"
+
+    def _count(self, endpoint, outcome):
+        counters = self.stats.setdefault(endpoint, {'hits': 0, 'misses': 0})
+        counters[outcome] += 1
+
+    def _read_disk(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"Error reading market cache {self.path}: {e}")
+        return {}
+
+    def _load(self):
+        now = time.time()
+        for key, entry in self._read_disk().items():
+            if entry.get('expires_at') is None or entry['expires_at'] > now:
+                self._entries[key] = entry
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.get('expires_at') is not None and entry['expires_at'] <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, value, ttl):
+        now = time.time()
+        self._entries[key] = {
+            'value': value,
+            'stored_at': now,
+            'expires_at': None if ttl is None else now + ttl,
+        }
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._dirty = True
+
+    def get(self, endpoint, params=None):
+        """Return a cached value or None, updating hit/miss counters"""
+        with self._lock:
+            entry = self._lookup(self.make_key(endpoint, params))
+            self._count(endpoint, 'hits' if entry else 'misses')
+            return entry['value'] if entry else None
+
+    def set(self, endpoint, params, value, ttl=None):
+        """Store a value using the endpoint's TTL unless ``ttl`` is given"""
+        with self._lock:
+            self._store(self.make_key(endpoint, params), value, self.ttls.get(endpoint) if ttl is None else ttl)
+
+    def get_or_fetch(self, endpoint, params, fetch):
+        """Return the cached value or call ``fetch()`` and cache a non-None result"""
+        value = self.get(endpoint, params)
+        if value is not None:
+            return value
+        value = fetch()
+        if value is not None:
+            self.set(endpoint, params, value)
+        return value
+
+    def candles(self, symbol, interval, start_ts, end_ts, fetch):
+        """Return raw KuCoin candle rows (newest first) for [start_ts, end_ts].
+
+        ``fetch(start_ts, end_ts)`` must return raw rows or None. Closed
+        candles are cached until they are more than MARKET_CACHE_KEEP_CANDLES
+        candles old (and at most MARKET_CACHE_MAX_CANDLES per series); only the
+        range after the last cached closed candle is requested, and that tail
+        is reused for its TTL.
+        """
+        step = INTERVAL_SECONDS[interval]
+        closed_before = (int(time.time()) // step) * step
+        key = f"candles:{symbol}:{interval}"
+        with self._lock:
+            entry = self._lookup(key)
+            series = entry['value'] if entry else None
+            if series and series['from'] <= start_ts <= series['to']:
+                fetch_start = series['to']
+            else:
+                series = {'rows': {}, 'from': start_ts, 'to': start_ts}
+                fetch_start = start_ts
+
+        tail = []
+        if fetch_start <= end_ts:
+            # کلید شامل مرز کندل جاری است تا کندل باز کش‌شده پس از بسته شدن دوباره گرفته شود
+            tail_params = {'symbol': symbol, 'type': interval, 'startAt': fetch_start, 'closedBefore': closed_before}
+            tail = self.get_or_fetch('kline', tail_params, lambda: fetch(fetch_start, end_ts))
+            if tail is None:
+                return None
+        else:
+            self._count('kline', 'hits')
+
+        with self._lock:
+            rows = dict(series['rows'])
+            open_rows = []
+            for row in tail:
+                ts = int(row[0])
+                if ts < closed_before:
+                    rows[str(ts)] = row
+                else:
+                    open_rows.append(row)
+            covered_to = max(series['to'], min(closed_before, end_ts - end_ts % step))
+            result = [row for ts, row in rows.items() if start_ts <= int(ts) <= end_ts]
+            result += [row for row in open_rows if start_ts <= int(row[0]) <= end_ts]
+
+            # فقط کندل‌های قدیمی‌تر از سقف سنی حذف می‌شوند، مستقل از بازه درخواستی این فراخوان
+            keep_from = closed_before - MARKET_CACHE_KEEP_CANDLES * step
+            rows = {ts: row for ts, row in rows.items() if int(ts) >= keep_from}
+            covered_from = max(series['from'], keep_from)
+            if len(rows) > MARKET_CACHE_MAX_CANDLES:
+                kept = sorted(rows, key=int)[-MARKET_CACHE_MAX_CANDLES:]
+                rows = {ts: rows[ts] for ts in kept}
+                covered_from = max(covered_from, int(kept[0]))
+            self._store(key, {'rows': rows, 'from': covered_from, 'to': covered_to}, None)
+
+        result.sort(key=lambda row: int(row[0]), reverse=True)
+        return result
+
+    def save(self):
+        """Merge with the on-disk cache and replace it atomically"""
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with FileLock(f"{self.path}.lock"):
+                    now = time.time()
+                    merged = OrderedDict()
+                    for key, entry in self._read_disk().items():
+                        if entry.get('expires_at') is None or entry['expires_at'] > now:
+                            merged[key] = entry
+                    for key, entry in self._entries.items():
+                        if entry.get('expires_at') is not None and entry['expires_at'] <= now:
+                            continue
+                        other = merged.get(key)
+                        if other is None or other.get('stored_at', 0) <= entry.get('stored_at', 0):
+                            merged[key] = entry
+                        merged.move_to_end(key)
+                    while len(merged) > self.max_entries:
+                        merged.popitem(last=False)
+                    tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                    with open(tmp_path, 'w') as f:
+                        json.dump(merged, f)
+                    os.replace(tmp_path, self.path)
+                self._dirty = False
+                print(f"Saved market cache ({len(merged)} entries) to {self.path}")
+            except Exception as e:
+                print(f"Error saving market cache: {e}")
+
+    def summary(self):
+        """Human readable hit/miss counters"""
+        parts = []
+        for endpoint, counters in sorted(self.stats.items()):
+            total = counters['hits'] + counters['misses']
+            parts.append(f"{endpoint}: {counters['hits']}/{total} hits")
+        return ", ".join(parts) if parts else "no lookups"
+
+_cache = None
+
+def get_cache():
+    """Process-wide cache instance, saved to disk at exit"""
+    global _cache
+    if _cache is None:
+        _cache = MarketCache()
+        atexit.register(_cache.save)
+    return _cache
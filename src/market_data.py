@@ -0,0 +1,304 @@
+import json
+import random
+import threading
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from config import (MARKET_DATA_PROVIDERS, MARKET_DATA_SETTINGS, KUCOIN_KLINE_ENDPOINT,
+                    KUCOIN_TICKER_ENDPOINT, KUCOIN_STATS_ENDPOINT)
+
+class ProviderError(Exception):
+    """The exchange answered with a non-success status code"""
+
+class KucoinProvider:
+    """KuCoin REST market data (also used for KuCoin-compatible mirrors).
+
+    Methods raise on transport, HTTP or exchange status errors so the client
+    can fail over, and return None when a successful answer has no data.
+    """
+
+    def __init__(self, name, base_url, timeout=None):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout or MARKET_DATA_SETTINGS['timeout']
+        self.session = requests.Session()
+
+    def _get(self, endpoint, params):
+        response = self.session.get(f"{self.base_url}{endpoint}", params=params, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        if data.get('code', '200000') != '200000':
+            raise ProviderError(f"{self.name} returned code {data.get('code')} for {endpoint}: {data.get('msg')}")
+        if not data.get('data'):
+            print(f"No data from {self.name} for {endpoint} {params}")
+            return None
+        return data['data']
+
+    def klines(self, symbol, interval, start_ts, end_ts):
+        """Kline rows, newest first: [ts, open, close, high, low, volume, turnover]"""
+        return self._get(KUCOIN_KLINE_ENDPOINT, {"symbol": symbol, "type": interval,
+                                                 "startAt": start_ts, "endAt": end_ts})
+
+    def ticker(self, symbol):
+        """Level-1 last price as returned by the exchange"""
+        return (self._get(KUCOIN_TICKER_ENDPOINT, {"symbol": symbol}) or {}).get('price')
+
+    def stats(self, symbol):
+        """24h stats dict (volValue is the quote volume)"""
+        return self._get(KUCOIN_STATS_ENDPOINT, {"symbol": symbol})
+
+PROVIDER_TYPES = {'kucoin': KucoinProvider}
+
+class ProviderHealth:
+    """Latency samples, success rate and circuit breaker state of one provider"""
+
+    def __init__(self, settings=None):
+        self.settings = settings or MARKET_DATA_SETTINGS
+        self.latencies = deque(maxlen=self.settings['latency_window'])
+        self.success_rate = 1.0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.opened_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, ok, latency, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self.requests += 1
+            # میانگین نمایی نرخ موفقیت برای امتیاز سلامت
+            self.success_rate = 0.9 * self.success_rate + 0.1 * (1.0 if ok else 0.0)
+            if ok:
+                self.latencies.append(latency)
+                self.consecutive_failures = 0
+                return
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.settings['failure_threshold']:
+                # مدار باز می‌شود؛ پس از پایان مهلت یک درخواست آزمایشی مجاز است
+                self.opened_until = now + self.settings['open_seconds']
+
+    def available(self, now=None):
+        return (time.time() if now is None else now) >= self.opened_until
+
+    def quantile(self, q):
+        with self._lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def hedge_delay(self):
+        """Seconds to wait for an answer before sending a duplicate request"""
+        if len(self.latencies) < self.settings['min_latency_samples']:
+            return self.settings['hedge_default_delay']
+        p95 = self.quantile(0.95)
+        return min(max(p95, self.settings['hedge_min_delay']), self.settings['hedge_max_delay'])
+
+    def score(self):
+        """Higher is healthier: success rate discounted by median latency"""
+        median = self.quantile(0.5)
+        return self.success_rate / (1.0 + (median or 0.0))
+
+class MarketDataClient:
+    """Market data calls spread over providers with hedging and circuit breaking.
+
+    Each call goes to the healthiest provider whose circuit is closed. When no
+    answer arrives within that provider's p95 latency a duplicate request is
+    sent to the next provider (or the same one when it is the only one), and
+    the first successful answer wins. Failed requests fail over immediately.
+    """
+
+    def __init__(self, providers=None, settings=None):
+        self.settings = dict(MARKET_DATA_SETTINGS, **(settings or {}))
+        if providers is None:
+            providers = [PROVIDER_TYPES[p['type']](p['name'], p['base_url'], self.settings['timeout'])
+                         for p in MARKET_DATA_PROVIDERS]
+        self.providers = providers
+        self.health = {p.name: ProviderHealth(self.settings) for p in providers}
+        self.stats = {'calls': 0, 'hedges': 0, 'hedge_wins': 0, 'failed_calls': 0}
+        self.call_latencies = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.settings['workers'],
+                                            thread_name_prefix='market-data')
+
+    def _ranked(self):
+        now = time.time()
+        healthy = [p for p in self.providers if self.health[p.name].available(now)]
+        # اگر مدار همه منابع باز باشد، باز هم سالم‌ترین آن‌ها امتحان می‌شود
+        return sorted(healthy or self.providers, key=lambda p: self.health[p.name].score(), reverse=True)
+
+    def _timed_call(self, provider, method, args):
+        started = time.perf_counter()
+        try:
+            result = getattr(provider, method)(*args)
+        except Exception:
+            self.health[provider.name].record(False, time.perf_counter() - started)
+            raise
+        self.health[provider.name].record(True, time.perf_counter() - started)
+        return result
+
+    def call(self, method, *args):
+        """Run a provider method with hedging and failover; None when every attempt fails"""
+        started = time.perf_counter()
+        candidates = self._ranked()
+        primary_delay = self.health[candidates[0].name].hedge_delay()
+        pending = {}
+        launched = []
+        errors = []
+
+        def launch():
+            provider = candidates[len(launched) % len(candidates)]
+            if launched and not pending and provider is launched[-1]:
+                time.sleep(min(0.5 * len(launched), 2.0))  # تلاش دوباره روی همان منبع
+            launched.append(provider)
+            pending[self._executor.submit(self._timed_call, provider, method, args)] = len(launched) - 1
+
+        launch()
+        result = None
+        succeeded = False
+        while pending and not succeeded:
+            can_hedge = self.settings['hedging'] and len(launched) < self.settings['max_attempts']
+            done, _ = wait(pending, timeout=primary_delay if can_hedge else None, return_when=FIRST_COMPLETED)
+            if not done:
+                with self._lock:
+                    self.stats['hedges'] += 1
+                launch()
+                continue
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(f"{launched[index].name}: {e}")
+                    continue
+                succeeded = True
+                if index > 0:
+                    with self._lock:
+                        self.stats['hedge_wins'] += 1
+                break
+            if not succeeded and not pending and len(launched) < self.settings['max_attempts']:
+                launch()
+
+        with self._lock:
+            self.stats['calls'] += 1
+            if not succeeded:
+                self.stats['failed_calls'] += 1
+            self.call_latencies.append(time.perf_counter() - started)
+        if not succeeded:
+            print(f"All market data requests failed for {method}{args}: {'; '.join(errors)}")
+        return result
+
+    def klines(self, symbol, interval, start_ts, end_ts):
+        return self.call('klines', symbol, interval, start_ts, end_ts)
+
+    def ticker(self, symbol):
+        return self.call('ticker', symbol)
+
+    def stats_24h(self, symbol):
+        return self.call('stats', symbol)
+
+    def latency_quantiles(self):
+        samples = sorted(self.call_latencies)
+        if not samples:
+            return {}
+        return {f"p{int(q * 100)}": samples[min(len(samples) - 1, int(q * len(samples)))]
+                for q in (0.5, 0.95, 0.99)}
+
+    def summary(self):
+        """Human readable call counters, latency quantiles and provider health"""
+        quantiles = ", ".join(f"{k} {v * 1000:.0f}ms" for k, v in self.latency_quantiles().items())
+        parts = [f"{self.stats['calls']} calls ({quantiles or 'no samples'}), {self.stats['hedges']} hedged, "
+                 f"{self.stats['hedge_wins']} won by hedge, {self.stats['failed_calls']} failed"]
+        now = time.time()
+        for provider in self.providers:
+            health = self.health[provider.name]
+            state = 'open' if not health.available(now) else 'closed'
+            parts.append(f"{provider.name}: {health.requests} requests, {health.failures} failures, "
+                         f"score {health.score():.2f}, circuit {state}")
+        return "; ".join(parts)
+
+_client = None
+
+def get_client():
+    """Process-wide market data client"""
+    global _client
+    if _client is None:
+        _client = MarketDataClient()
+    return _client
+
+def request_kline_rows(symbol, interval, start_ts, end_ts):
+    """Request raw kline rows from the market data providers"""
+    rows = get_client().klines(symbol, interval, start_ts, end_ts)
+    if not rows:
+        print(f"No kline data for {symbol} on {interval}")
+        return None
+    return rows
+
+# ----- Local stand-in servers for testing latency and failures -----
+
+def start_standin_server(median_latency=0.02, stall_rate=0.03, stall_seconds=1.0, failure_rate=0.0, seed=1):
+    """KuCoin-shaped market data server on a random localhost port with injected latency and errors"""
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with rng_lock:
+                delay = rng.lognormvariate(0, 0.3) * median_latency
+                stalled = rng.random() < stall_rate
+                failed = rng.random() < failure_rate
+            time.sleep(delay + (stall_seconds if stalled else 0))
+            if failed:
+                body, status = b'{"code": "500000", "msg": "injected failure"}', 500
+            else:
+                now = int(time.time())
+                data = {
+                    KUCOIN_STATS_ENDPOINT: {"symbol": "X-USDT", "volValue": "1000000"},
+                    KUCOIN_TICKER_ENDPOINT: {"price": "1.0"},
+                    KUCOIN_KLINE_ENDPOINT: [[str(now - i * 1800), "1", "1", "1", "1", "1", "1"] for i in range(10)],
+                }.get(self.path.split('?')[0])
+                body, status = json.dumps({"code": "200000", "data": data}).encode('utf-8'), 200
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def _self_test(calls=300):
+    """Compare plain and hedged clients against stand-in servers"""
+    _, primary = start_standin_server(seed=1)
+    _, mirror = start_standin_server(seed=2)
+    _, broken = start_standin_server(failure_rate=1.0, seed=3)
+    scenarios = [
+        ('single provider, no hedging', [primary], {'hedging': False, 'max_attempts': 1}),
+        ('single provider, hedged', [primary], {}),
+        ('primary + mirror, hedged', [primary, mirror], {}),
+        ('failing provider + mirror', [broken, mirror], {}),
+    ]
+    for title, urls, settings in scenarios:
+        settings = dict(settings, timeout=5, hedge_default_delay=0.1)
+        client = MarketDataClient([KucoinProvider(f"standin-{i}", url, 5) for i, url in enumerate(urls)], settings)
+        for _ in range(calls):
+            client.stats_24h('X-USDT')
+        print(f"{title}: {client.summary()}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Market data providers')
+    parser.add_argument('--self-test', action='store_true',
+                        help='Measure hedging and failover against local stand-in servers')
+    parser.add_argument('--calls', type=int, default=300)
+    args = parser.parse_args()
+    if args.self_test:
+        _self_test(args.calls)
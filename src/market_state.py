@@ -0,0 +1,147 @@
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from config import QUERY_SERVICE_SETTINGS
+
+def _json_value(value):
+    """Convert pandas/numpy scalars to JSON-safe Python values"""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        return None
+    return value
+
+class MarketState:
+    """Latest indicator rows, active signals and scan metadata held in memory.
+
+    Rows are stored already JSON-encoded so single-symbol queries are a dict
+    lookup, and bulk queries only join pre-encoded fragments.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}      # (symbol, timeframe) -> encoded JSON of the latest row
+        self._updated = {}   # (symbol, timeframe) -> time the row was published
+        self._universe = []
+        self._signals = b"[]"
+        self._meta = {}
+
+    def update_indicators(self, symbol, timeframe, df):
+        """Store the last prepare_dataframe row for a symbol and timeframe"""
+        if df is None or len(df) == 0:
+            return
+        row = {key: _json_value(value) for key, value in df.iloc[-1].items()}
+        row['symbol'] = symbol
+        row['timeframe'] = timeframe
+        encoded = json.dumps(row).encode('utf-8')
+        with self._lock:
+            self._rows[(symbol, timeframe)] = encoded
+            self._updated[(symbol, timeframe)] = time.time()
+
+    def update_signals(self, signals):
+        """Replace the active signal list"""
+        encoded = json.dumps([s for s in signals if s.get('status') == 'active'], default=str).encode('utf-8')
+        with self._lock:
+            self._signals = encoded
+
+    def update_meta(self, **values):
+        """Merge scan metadata (start time, progress, counters)"""
+        with self._lock:
+            self._meta.update(values)
+            self._meta['updated_at'] = time.time()
+
+    def set_universe(self, symbols):
+        """Symbols the scanner is configured for, used to report missing rows"""
+        with self._lock:
+            self._universe = list(symbols)
+
+    def indicators(self, symbols=None, timeframe=None):
+        """Encoded JSON list of latest rows filtered by symbols and timeframe"""
+        with self._lock:
+            items = list(self._rows.items())
+        wanted = set(symbols) if symbols else None
+        parts = [encoded for (symbol, tf), encoded in items
+                 if (wanted is None or symbol in wanted) and (timeframe is None or tf == timeframe)]
+        return b"[" + b",".join(parts) + b"]"
+
+    def row(self, symbol, timeframe):
+        with self._lock:
+            return self._rows.get((symbol, timeframe))
+
+    def signals(self):
+        with self._lock:
+            return self._signals
+
+    def meta(self):
+        now = time.time()
+        with self._lock:
+            meta = dict(self._meta)
+            freshness = {}
+            for (symbol, timeframe), updated in self._updated.items():
+                freshness.setdefault(symbol, {})[timeframe] = round(now - updated, 1)
+            meta['symbols'] = len(freshness)
+            # عمر هر ردیف به ثانیه و نمادهایی که هنوز ردیفی ندارند
+            meta['row_age_seconds'] = freshness
+            meta['missing'] = [symbol for symbol in self._universe if symbol not in freshness]
+        return json.dumps(meta, default=str).encode('utf-8')
+
+market_state = MarketState()
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    """Read-only JSON endpoints over the in-memory market state.
+
+    GET /indicators?symbol=BTC-USDT&timeframe=30min  single latest row
+    GET /indicators?symbols=BTC-USDT,ETH-USDT        bulk (all symbols when omitted)
+    GET /signals                                     active signals
+    GET /meta                                        scan metadata, row ages, missing symbols
+    """
+
+    state = market_state
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        timeframe = query.get('timeframe', [None])[0]
+        if url.path == '/indicators':
+            symbol = query.get('symbol', [None])[0]
+            if symbol and timeframe:
+                body = self.state.row(symbol, timeframe)
+                if body is None:
+                    return self._send(404, b'{"error": "unknown symbol or timeframe"}')
+                return self._send(200, body)
+            symbols = query.get('symbols', [''])[0].split(',') if 'symbols' in query else ([symbol] if symbol else None)
+            return self._send(200, self.state.indicators(symbols, timeframe))
+        if url.path == '/signals':
+            return self._send(200, self.state.signals())
+        if url.path == '/meta':
+            return self._send(200, self.state.meta())
+        self._send(404, b'{"error": "not found"}')
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # بدون لاگ برای هر درخواست
+
+def start_query_service(host=None, port=None):
+    """Serve market_state on a localhost HTTP port from a daemon thread"""
+    host = host or QUERY_SERVICE_SETTINGS['host']
+    port = QUERY_SERVICE_SETTINGS['port'] if port is None else port
+    try:
+        server = ThreadingHTTPServer((host, port), _QueryHandler)
+    except OSError as e:
+        print(f"Error starting market state service on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Market state service listening on http://{host}:{server.server_address[1]}")
+    return server
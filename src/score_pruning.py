@@ -0,0 +1,257 @@
+import math
+import time
+from config import SCALPING_SETTINGS, PRUNING_SETTINGS, PRIMARY_TIMEFRAME
+from market_cache import INTERVAL_SECONDS
+from signal_generator import calculate_score
+
+# تلورانس نسبی مقایسه‌ها تا خطای ممیز شناور باعث حذف سیگنال نشود
+_TOLERANCE = 1e-9
+
+def capture_prune_state(df, now=None):
+    """Snapshot the recursive indicator state at the last closed candle.
+
+    The snapshot holds the EMA/MACD/RSI/ATR recursion values and the short
+    rolling windows used by prepare_dataframe, so a later scan can roll the
+    indicators forward over only the new candles.
+    Returns None when the frame does not contain enough history.
+    """
+    now = time.time() if now is None else now
+    step = INTERVAL_SECONDS[PRIMARY_TIMEFRAME]
+    s = SCALPING_SETTINGS
+    close = df['close']
+    diff = close.diff(1)
+    # همان بازگشت‌های کتابخانه ta (ewm با adjust=False)
+    macd_fast = close.ewm(span=s['macd_fast'], adjust=False).mean()
+    macd_slow = close.ewm(span=s['macd_slow'], adjust=False).mean()
+    avg_gain = diff.where(diff > 0, 0.0).ewm(alpha=1 / s['rsi_period'], adjust=False).mean()
+    avg_loss = (-diff.where(diff < 0, 0.0)).ewm(alpha=1 / s['rsi_period'], adjust=False).mean()
+
+    timestamps = [ts.timestamp() for ts in df['timestamp']]
+    closed = [i for i, ts in enumerate(timestamps) if ts + step <= now]
+    if not closed or closed[-1] < s['bb_period']:
+        return None
+    i = closed[-1]
+    row = df.iloc[i]
+    state = {
+        'timestamp': int(timestamps[i]),
+        'close': float(row['close']),
+        'volume': float(row['volume']),
+        'ema_short': float(row['ema_short']),
+        'ema_medium': float(row['ema_medium']),
+        'macd_fast': float(macd_fast.iloc[i]),
+        'macd_slow': float(macd_slow.iloc[i]),
+        'macd_signal': float(row['macd_signal']),
+        'rsi': float(row['rsi']),
+        'avg_gain': float(avg_gain.iloc[i]),
+        'avg_loss': float(avg_loss.iloc[i]),
+        'atr': float(row['atr']),
+        'closes': [float(x) for x in close.iloc[i - s['bb_period'] + 2:i + 1]],
+        'lows': [float(x) for x in df['low'].iloc[i - 8:i + 1]],
+        'highs': [float(x) for x in df['high'].iloc[i - 8:i + 1]],
+    }
+    if any(isinstance(v, float) and math.isnan(v) for v in state.values()):
+        return None
+    return state
+
+def _roll_forward(state, candles):
+    """Indicator rows for the stored candle followed by each new candle"""
+    s = SCALPING_SETTINGS
+    a_short = 2 / (s['ema_short'] + 1)
+    a_medium = 2 / (s['ema_medium'] + 1)
+    a_fast = 2 / (s['macd_fast'] + 1)
+    a_slow = 2 / (s['macd_slow'] + 1)
+    a_signal = 2 / (s['macd_signal'] + 1)
+    a_rsi = 1 / s['rsi_period']
+    ema_short, ema_medium = state['ema_short'], state['ema_medium']
+    fast, slow, signal = state['macd_fast'], state['macd_slow'], state['macd_signal']
+    avg_gain, avg_loss, atr = state['avg_gain'], state['avg_loss'], state['atr']
+    prev_close, prev_volume = state['close'], state['volume']
+    closes, lows, highs = list(state['closes']), list(state['lows']), list(state['highs'])
+
+    rows = [{
+        'rsi': state['rsi'], 'ema_short': ema_short, 'ema_medium': ema_medium,
+        'macd': fast - slow, 'macd_signal': signal,
+    }]
+    for _, open_, high, low, close, volume in candles:
+        change = close - prev_close
+        avg_gain = a_rsi * max(change, 0.0) + (1 - a_rsi) * avg_gain
+        avg_loss = a_rsi * max(-change, 0.0) + (1 - a_rsi) * avg_loss
+        ema_short = a_short * close + (1 - a_short) * ema_short
+        ema_medium = a_medium * close + (1 - a_medium) * ema_medium
+        fast = a_fast * close + (1 - a_fast) * fast
+        slow = a_slow * close + (1 - a_slow) * slow
+        signal = a_signal * (fast - slow) + (1 - a_signal) * signal
+        true_range = max(high - low, abs(high - prev_close), abs(low - prev_close))
+        atr = (atr * 13 + true_range) / 14
+
+        closes = (closes + [close])[-s['bb_period']:]
+        lows = (lows + [low])[-10:]
+        highs = (highs + [high])[-10:]
+        mean = sum(closes) / len(closes)
+        std = math.sqrt(sum((c - mean) ** 2 for c in closes) / len(closes))
+        rows.append({
+            'rsi': 100.0 if avg_loss == 0 else 100 - 100 / (1 + avg_gain / avg_loss),
+            'ema_short': ema_short, 'ema_medium': ema_medium,
+            'macd': fast - slow, 'macd_signal': signal,
+            'bb_upper': mean + s['bb_std'] * std, 'bb_lower': mean - s['bb_std'] * std,
+            'atr': atr, 'support': min(lows), 'resistance': max(highs),
+            'volume_change': volume / prev_volume - 1 if prev_volume else math.inf,
+            'price_change': change / prev_close,
+            'open': open_, 'close': close,
+        })
+        prev_close, prev_volume = close, volume
+    return rows
+
+def _lt(a, b):
+    """a < b, leaning towards True within floating point noise"""
+    return a < b + _TOLERANCE * max(abs(a), abs(b))
+
+def _gt(a, b):
+    return _lt(b, a)
+
+def _le(a, b):
+    """a <= b, leaning towards True within floating point noise"""
+    return a <= b + _TOLERANCE * max(abs(a), abs(b))
+
+def _ge(a, b):
+    return _le(b, a)
+
+def score_upper_bounds(state, df, now=None):
+    """Upper bounds on the (buy, sell) scores generate_signals could produce.
+
+    ``state`` comes from capture_prune_state on a previous scan and ``df`` is
+    the raw primary-timeframe frame of this scan. Every primary factor is
+    evaluated exactly from the rolled-forward indicators; the higher
+    timeframe trend is unknown without its klines and is assumed present on
+    both sides. Returns ((buy, sell), latest indicator row) or None when no
+    safe bound exists.
+    """
+    if not state or df is None or len(df) == 0:
+        return None
+    now = time.time() if now is None else now
+    step = INTERVAL_SECONDS[PRIMARY_TIMEFRAME]
+    if now - state['timestamp'] > PRUNING_SETTINGS['max_state_age_seconds']:
+        return None
+
+    candles = []
+    expected = state['timestamp'] + step
+    for row in df.itertuples(index=False):
+        ts = int(row.timestamp.timestamp())
+        if ts <= state['timestamp']:
+            continue
+        if ts != expected:
+            return None  # شکاف در کندل‌ها؛ بازگشت‌ها قابل ادامه نیستند
+        candles.append((ts, row.open, row.high, row.low, row.close, row.volume))
+        expected += step
+    if not candles:
+        return None
+
+    rows = _roll_forward(state, candles)
+    prev, latest = rows[-2], rows[-1]
+    s = SCALPING_SETTINGS
+    close = latest['close']
+
+    buy_factors = {'higher_tf'}
+    if _lt(latest['rsi'], s['rsi_oversold']) and _le(prev['rsi'], latest['rsi']):
+        buy_factors.add('rsi')
+    if _le(prev['ema_short'], prev['ema_medium']) and _gt(latest['ema_short'], latest['ema_medium']):
+        buy_factors.add('ema')
+    if _le(prev['macd'], prev['macd_signal']) and _gt(latest['macd'], latest['macd_signal']):
+        buy_factors.add('macd')
+    if _le(close, latest['bb_lower'] * 1.01):
+        buy_factors.add('bb')
+    if _gt(latest['volume_change'], s['volume_change_threshold']):
+        buy_factors.add('volume')
+    if _le(close, latest['support'] * 1.01):
+        buy_factors.add('support')
+    if _gt(latest['price_change'], 0.003) and _gt(close, latest['open']):
+        buy_factors.add('price_action')
+
+    sell_factors = {'higher_tf'}
+    if _gt(latest['rsi'], s['rsi_overbought']) and _ge(prev['rsi'], latest['rsi']):
+        sell_factors.add('rsi')
+    if _ge(prev['ema_short'], prev['ema_medium']) and _lt(latest['ema_short'], latest['ema_medium']):
+        sell_factors.add('ema')
+    if _ge(prev['macd'], prev['macd_signal']) and _lt(latest['macd'], latest['macd_signal']):
+        sell_factors.add('macd')
+    if _ge(close, latest['bb_upper'] * 0.99):
+        sell_factors.add('bb')
+    if _ge(close, latest['resistance'] * 0.99):
+        sell_factors.add('resistance')
+    if _lt(latest['price_change'], -0.003) and _lt(close, latest['open']):
+        sell_factors.add('price_action')
+
+    atr = latest['atr'] * (1 - _TOLERANCE)
+    bounds = (
+        calculate_score(buy_factors, set(), atr, close),
+        calculate_score(set(), sell_factors, atr, close),
+    )
+    return bounds, latest
+
+def can_prune(state, df, now=None):
+    """Return (prunable, bounds, latest row); prunable when neither side can reach min_score_threshold"""
+    result = score_upper_bounds(state, df, now)
+    if result is None:
+        return False, None, None
+    upper, latest = result
+    return max(upper) < SCALPING_SETTINGS['min_score_threshold'], upper, latest
+
+def _soundness_check(seeds=100, rows=300):
+    """Compare pruning bounds with the full signal path on synthetic frames.
+
+    Random walks cover the general case; flat candles (close equal to the
+    previous close) after an oversold downtrend exercise the inclusive
+    comparisons of generate_signals. Every emitted signal must be unprunable
+    and scored no higher than its bound.
+    """
+    import numpy as np
+    import pandas as pd
+    from crypto_analyzer import prepare_dataframe
+    from signal_generator import generate_signals
+
+    step = INTERVAL_SECONDS[PRIMARY_TIMEFRAME]
+    higher = pd.DataFrame({'trend_confirmed': ['neutral', 'neutral']})
+    ok = True
+    for scenario in ('random_walk', 'flat_candle'):
+        emitted = violations = pruned = 0
+        for seed in range(seeds):
+            rng = np.random.default_rng(seed)
+            returns = rng.normal(0, 0.01, rows)
+            volume = rng.uniform(1000, 3000, rows)
+            if scenario == 'flat_candle':
+                # روند نزولی اشباع فروش و سپس کندلی با بسته شدن برابر کندل قبلی و حجم بالا
+                returns[-30:] = rng.normal(-0.006, 0.004, 30)
+                returns[-1] = 0.0
+                volume[-1] = volume[-2] * 3
+            close = 100 * np.exp(np.cumsum(returns))
+            open_ = np.concatenate(([close[0]], close[:-1])) * (1 + rng.normal(0, 0.001, rows))
+            high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.005, rows))
+            low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.005, rows))
+            start = 1_700_000_000 // step * step
+            df = pd.DataFrame({
+                'timestamp': pd.to_datetime(start + np.arange(rows) * step, unit='s'),
+                'open': open_, 'high': high, 'low': low, 'close': close,
+                'volume': volume,
+            })
+            now = start + rows * step
+            state = capture_prune_state(prepare_dataframe(df.iloc[:-1].copy()), now=now - step)
+            prunable, upper, _ = can_prune(state, df.copy(), now=now)
+            pruned += prunable
+            for signal in generate_signals(prepare_dataframe(df.copy()), higher, 'CHECK-USDT'):
+                emitted += 1
+                bound = None if upper is None else upper[0 if signal['type'] == 'BUY' else 1]
+                if prunable or (bound is not None and bound < signal['score']):
+                    violations += 1
+                    print(f"{scenario} seed {seed}: {signal['type']} score {signal['score']} but bounds {upper}")
+        print(f"{scenario}: {seeds} frames, {pruned} prunable, {emitted} signals, {violations} violations")
+        ok = ok and violations == 0
+    return ok
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Score upper-bound pruning')
+    parser.add_argument('--check', action='store_true', help='Check bounds against the full signal path')
+    parser.add_argument('--seeds', type=int, default=100)
+    args = parser.parse_args()
+    if args.check:
+        raise SystemExit(0 if _soundness_check(args.seeds) else 1)
@@ -0,0 +1,260 @@
+import json
+import hashlib
+import os
+import re
+import shutil
+import argparse
+import pytz
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from config import ANALYTICS_SIGNALS_DATASET, ANALYTICS_MANIFEST_FILE
+from signal_tracker import load_signals, calculate_profit_loss, calculate_duration
+
+# الگوهای تشخیص فاکتورها از متن دلایل سیگنال
+FACTOR_PATTERNS = {
+    'rsi': re.compile(r"RSI in (oversold|overbought) zone"),
+    'ema': re.compile(r"Short EMA crossed"),
+    'macd': re.compile(r"MACD crossed"),
+    'bb': re.compile(r"Bollinger Band"),
+    'volume': re.compile(r"Volume surge"),
+    'support': re.compile(r"Price at support"),
+    'resistance': re.compile(r"Price at resistance"),
+    'price_action': re.compile(r"Strong (bullish|bearish) candle"),
+    'higher_tf': re.compile(r"trend in 1-hour timeframe"),
+}
+
+SIGNALS_SCHEMA = pa.schema(
+    [
+        ('signal_id', pa.string()),
+        ('symbol', pa.string()),
+        ('type', pa.string()),
+        ('status', pa.string()),
+        ('score', pa.int32()),
+        ('score_bucket', pa.int32()),
+        ('entry_price', pa.float64()),
+        ('target_price', pa.float64()),
+        ('stop_loss', pa.float64()),
+        ('closed_price', pa.float64()),
+        ('risk_reward_ratio', pa.float64()),
+        ('created_at', pa.timestamp('us', tz='UTC')),
+        ('closed_at', pa.timestamp('us', tz='UTC')),
+        ('profit_loss_pct', pa.float64()),
+        ('duration_hours', pa.float64()),
+        ('mfe_pct', pa.float64()),
+        ('mae_pct', pa.float64()),
+    ]
+    + [(f"factor_{name}", pa.bool_()) for name in FACTOR_PATTERNS]
+)
+
+PARTITIONING = ds.partitioning(pa.schema([('month', pa.string())]), flavor='hive')
+
+def signal_id(signal):
+    """Stable identifier for a stored signal"""
+    return f"{signal['symbol']}|{signal['type']}|{signal['created_at']}"
+
+def signal_month(signal):
+    """Partition key (UTC year-month) of a signal"""
+    return pd.Timestamp(signal['created_at']).tz_convert('UTC').strftime('%Y-%m')
+
+def detect_factors(reasons):
+    """Return the set of scoring factors mentioned in a signal's reasons"""
+    return {name for name, pattern in FACTOR_PATTERNS.items() if pattern.search(reasons or '')}
+
+def _to_utc(value):
+    """Convert an ISO string or datetime to a UTC timestamp, assuming Tehran time when naive"""
+    if value is None or value == '':
+        return None
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize(pytz.timezone('Asia/Tehran'))
+    return ts.tz_convert('UTC')
+
+def signal_to_row(signal):
+    """Flatten a stored signal into an analytics row"""
+    closed_price = float(signal['closed_price']) if signal.get('closed_price') else None
+    is_closed = signal['status'] != 'active'
+    profit_loss = calculate_profit_loss(signal, closed_price) if closed_price is not None else None
+    # مدت زمان سیگنال‌های فعال در هر اجرا تغییر می‌کند، پس فقط برای سیگنال‌های بسته ذخیره می‌شود
+    duration = calculate_duration(signal['created_at'], signal.get('closed_at')) if is_closed else None
+    created_at = _to_utc(signal['created_at'])
+    closed_at = _to_utc(signal.get('closed_at'))
+    score = int(signal.get('score', 0))
+    factors = detect_factors(signal.get('reasons'))
+
+    row = {
+        'signal_id': signal_id(signal),
+        'symbol': signal['symbol'],
+        'type': signal['type'],
+        'status': signal['status'],
+        'score': score,
+        'score_bucket': (score // 10) * 10,
+        'entry_price': float(signal.get('entry_price', signal['current_price'])),
+        'target_price': float(signal['target_price']),
+        'stop_loss': float(signal['stop_loss']),
+        'closed_price': closed_price,
+        'risk_reward_ratio': float(signal['risk_reward_ratio']) if signal.get('risk_reward_ratio') is not None else None,
+        'created_at': created_at.to_pydatetime() if created_at is not None else None,
+        'closed_at': closed_at.to_pydatetime() if closed_at is not None else None,
+        'profit_loss_pct': profit_loss,
+        'duration_hours': duration,
+        'mfe_pct': signal.get('max_favorable_excursion'),
+        'mae_pct': signal.get('max_adverse_excursion'),
+    }
+    for name in FACTOR_PATTERNS:
+        row[f"factor_{name}"] = name in factors
+    return row
+
+def _row_hash(row):
+    # هش روی ردیف خروجی، نه سیگنال خام؛ فیلدهایی مثل checked_until که هر ساعت عوض می‌شوند پارتیشن را بازنویسی نمی‌کنند
+    return hashlib.sha1(json.dumps(row, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def _load_manifest():
+    try:
+        if os.path.exists(ANALYTICS_MANIFEST_FILE):
+            with open(ANALYTICS_MANIFEST_FILE, 'r') as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"Error loading analytics manifest, rebuilding: {e}")
+    return {}
+
+def _atomic_write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _partition_dir(month):
+    return os.path.join(ANALYTICS_SIGNALS_DATASET, f"month={month}")
+
+def _write_partition(month, rows):
+    """Atomically replace a single month partition"""
+    partition_dir = _partition_dir(month)
+    if not rows:
+        shutil.rmtree(partition_dir, ignore_errors=True)
+        return
+    os.makedirs(partition_dir, exist_ok=True)
+    rows = sorted(rows, key=lambda r: (r['symbol'], r['created_at']))
+    table = pa.Table.from_pylist(rows, schema=SIGNALS_SCHEMA)
+    path = os.path.join(partition_dir, 'part-0.parquet')
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+
+def export_signals(signals=None, full=False):
+    """Incrementally export signal history to the month-partitioned Parquet dataset.
+
+    Only partitions containing new, changed or removed signals are rewritten;
+    the manifest keeps a hash of each signal's exported row to detect changes.
+    Returns the number of rows that changed.
+    """
+    if signals is None:
+        signals = load_signals()
+    manifest = {} if full else _load_manifest()
+
+    current = {}
+    by_month = {}
+    for signal in signals:
+        try:
+            month = signal_month(signal)
+            row = signal_to_row(signal)
+        except Exception as e:
+            print(f"Skipping signal {signal.get('symbol', 'unknown')} in analytics export: {e}")
+            continue
+        current[row['signal_id']] = {'hash': _row_hash(row), 'month': month}
+        by_month.setdefault(month, []).append(row)
+
+    changed_ids = [sid for sid, entry in current.items() if manifest.get(sid) != entry]
+    removed_ids = [sid for sid in manifest if sid not in current]
+    dirty_months = {current[sid]['month'] for sid in changed_ids}
+    dirty_months |= {manifest[sid]['month'] for sid in removed_ids}
+    if full:
+        shutil.rmtree(ANALYTICS_SIGNALS_DATASET, ignore_errors=True)
+        dirty_months = set(by_month)
+
+    if not dirty_months:
+        print("Analytics export up to date, nothing to write")
+        return 0
+
+    for month in sorted(dirty_months):
+        rows = by_month.get(month, [])
+        _write_partition(month, rows)
+        print(f"Wrote analytics partition {month} ({len(rows)} rows)")
+
+    _atomic_write_json(ANALYTICS_MANIFEST_FILE, current)
+    changed = len(changed_ids) + len(removed_ids)
+    print(f"Analytics export complete: {changed} changed rows in {len(dirty_months)} partitions")
+    return changed
+
+def _month_filter(start, end):
+    expr = None
+    if start is not None:
+        expr = ds.field('month') >= start.strftime('%Y-%m')
+    if end is not None:
+        end_expr = ds.field('month') <= end.strftime('%Y-%m')
+        expr = end_expr if expr is None else expr & end_expr
+    return expr
+
+def query_signals(symbol=None, signal_type=None, status=None, start=None, end=None,
+                  factor=None, score_bucket=None, min_score=None, columns=None):
+    """Query the exported signal dataset.
+
+    Filters are pushed down to Parquet, and date ranges also prune month
+    partitions. ``symbol``, ``factor`` and ``score_bucket`` accept a single
+    value or a list; ``factor`` requires every listed factor to be present.
+    ``start``/``end`` are inclusive bounds on ``created_at``. Only the requested
+    ``columns`` are read. Returns a pandas DataFrame.
+    """
+    if not os.path.isdir(ANALYTICS_SIGNALS_DATASET):
+        print(f"No analytics dataset at {ANALYTICS_SIGNALS_DATASET}")
+        return pd.DataFrame(columns=columns or SIGNALS_SCHEMA.names)
+
+    # طرحواره صریح تا پارتیشن‌های قدیمی‌تر با ستون‌های کمتر هم خوانده شوند
+    dataset = ds.dataset(ANALYTICS_SIGNALS_DATASET, format='parquet', partitioning=PARTITIONING,
+                         schema=SIGNALS_SCHEMA.append(pa.field('month', pa.string())))
+    filters = []
+    if symbol is not None:
+        symbols = [symbol] if isinstance(symbol, str) else list(symbol)
+        filters.append(ds.field('symbol').isin(symbols))
+    if signal_type is not None:
+        filters.append(ds.field('type') == signal_type)
+    if status is not None:
+        filters.append(ds.field('status') == status)
+    start = _to_utc(start)
+    end = _to_utc(end)
+    month_expr = _month_filter(start, end)
+    if month_expr is not None:
+        filters.append(month_expr)
+    utc_type = pa.timestamp('us', tz='UTC')
+    if start is not None:
+        filters.append(ds.field('created_at') >= pa.scalar(start.to_pydatetime(), type=utc_type))
+    if end is not None:
+        filters.append(ds.field('created_at') <= pa.scalar(end.to_pydatetime(), type=utc_type))
+    if factor is not None:
+        for name in ([factor] if isinstance(factor, str) else factor):
+            if name not in FACTOR_PATTERNS:
+                raise ValueError(f"Unknown factor: {name}")
+            filters.append(ds.field(f"factor_{name}") == True)  # noqa: E712
+    if score_bucket is not None:
+        buckets = [score_bucket] if isinstance(score_bucket, int) else list(score_bucket)
+        filters.append(ds.field('score_bucket').isin(buckets))
+    if min_score is not None:
+        filters.append(ds.field('score') >= min_score)
+
+    expr = None
+    for f in filters:
+        expr = f if expr is None else expr & f
+    table = dataset.to_table(columns=columns, filter=expr)
+    return table.to_pandas()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export signal history to Parquet and query it')
+    parser.add_argument('--full', action='store_true', help='Rebuild the whole dataset instead of exporting incrementally')
+    parser.add_argument('--symbol', help='Print exported signals for this symbol')
+    args = parser.parse_args()
+
+    export_signals(full=args.full)
+    if args.symbol:
+        print(query_signals(symbol=args.symbol).to_string())
@@ -0,0 +1,202 @@
+import json
+import os
+import time
+import numpy as np
+from filelock import FileLock
+from config import CORRELATION_CACHE_FILE, CORRELATION_SETTINGS, PRIMARY_TIMEFRAME
+from market_cache import INTERVAL_SECONDS
+
+class CorrelationCache:
+    """Rolling log-return windows per symbol and their pairwise correlation matrix.
+
+    Each scan appends only the candles closed since the previous update, and
+    only the matrix rows of symbols whose window changed are recomputed.
+    Pairs are correlated over the timestamps both windows share.
+    """
+
+    def __init__(self, path=CORRELATION_CACHE_FILE, interval=PRIMARY_TIMEFRAME, settings=None):
+        self.path = path
+        self.interval = interval
+        self.settings = dict(CORRELATION_SETTINGS, **(settings or {}))
+        self.series = {}     # symbol -> {'timestamps', 'returns', 'last_ts', 'last_close'}
+        self._symbols = []   # row/column order of the matrix
+        self._index = {}
+        self._matrix = np.empty((0, 0))
+        self._dirty = set()
+        self._load()
+
+    def _load(self):
+        try:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('interval') != self.interval or data.get('window') != self.settings['window']:
+                return
+            self.series = data.get('series', {})
+            matrix = np.array(data.get('matrix', []), dtype=float)
+            if matrix.shape == (len(data.get('symbols', [])),) * 2:
+                self._symbols = list(data['symbols'])
+                self._index = {symbol: i for i, symbol in enumerate(self._symbols)}
+                self._matrix = matrix
+            self._dirty = set(self.series) - set(self._symbols)
+        except Exception as e:
+            print(f"Error loading correlation cache, rebuilding: {e}")
+            self.series = {}
+
+    def save(self):
+        """Persist windows and matrix atomically"""
+        try:
+            self.matrix()
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with FileLock(f"{self.path}.lock"):
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump({
+                        'interval': self.interval,
+                        'window': self.settings['window'],
+                        'series': self.series,
+                        'symbols': self._symbols,
+                        'matrix': [[None if np.isnan(v) else round(float(v), 6) for v in row] for row in self._matrix],
+                    }, f)
+                os.replace(tmp_path, self.path)
+            print(f"Saved correlation cache for {len(self.series)} symbols to {self.path}")
+        except Exception as e:
+            print(f"Error saving correlation cache: {e}")
+
+    def update(self, symbol, df, now=None):
+        """Append returns of candles closed since the last update; True when the window changed"""
+        if df is None or len(df) < 2:
+            return False
+        now = time.time() if now is None else now
+        step = INTERVAL_SECONDS[self.interval]
+        timestamps = np.array([int(ts.timestamp()) for ts in df['timestamp']], dtype=np.int64)
+        closes = df['close'].to_numpy(dtype=float)
+        entry = self.series.get(symbol)
+        last_ts = entry['last_ts'] if entry else None
+
+        closed = timestamps + step <= now
+        if last_ts is not None:
+            closed &= timestamps > last_ts
+        timestamps, closes = timestamps[closed], closes[closed]
+        if len(timestamps) == 0:
+            return False
+
+        # بازده اولین کندل جدید فقط وقتی محاسبه می‌شود که دقیقاً بعد از کندل ذخیره‌شده باشد
+        first_prev = entry['last_close'] if entry and timestamps[0] == last_ts + step else np.nan
+        previous = np.concatenate(([first_prev], closes[:-1]))
+        contiguous = np.concatenate(([True], np.diff(timestamps) == step))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = np.where(contiguous, np.log(closes / previous), np.nan)
+        valid = np.isfinite(returns)
+
+        window = self.settings['window']
+        old_ts = entry['timestamps'] if entry else []
+        old_returns = entry['returns'] if entry else []
+        self.series[symbol] = {
+            'timestamps': (old_ts + timestamps[valid].tolist())[-window:],
+            'returns': (old_returns + [round(float(r), 10) for r in returns[valid]])[-window:],
+            'last_ts': int(timestamps[-1]),
+            'last_close': float(closes[-1]),
+        }
+        self._dirty.add(symbol)
+        return True
+
+    def _resize(self):
+        """Reorder the matrix for the current symbol set, keeping computed pairs"""
+        symbols = sorted(self.series)
+        if symbols == self._symbols:
+            return
+        matrix = np.full((len(symbols), len(symbols)), np.nan)
+        kept = [s for s in symbols if s in self._index]
+        if kept:
+            new_pos = [symbols.index(s) for s in kept]
+            old_pos = [self._index[s] for s in kept]
+            matrix[np.ix_(new_pos, new_pos)] = self._matrix[np.ix_(old_pos, old_pos)]
+        self._dirty |= set(symbols) - set(kept)
+        self._symbols = symbols
+        self._index = {symbol: i for i, symbol in enumerate(symbols)}
+        self._matrix = matrix
+
+    def matrix(self):
+        """(symbols, matrix) with rows of changed symbols recomputed in one vectorized pass"""
+        self._resize()
+        dirty = sorted(self._index[s] for s in self._dirty if s in self._index)
+        self._dirty = set()
+        if not dirty:
+            return self._symbols, self._matrix
+
+        grid = np.unique(np.concatenate([np.asarray(self.series[s]['timestamps'], dtype=np.int64)
+                                         for s in self._symbols]))
+        values = np.zeros((len(grid), len(self._symbols)))
+        present = np.zeros_like(values)
+        for j, symbol in enumerate(self._symbols):
+            rows = np.searchsorted(grid, self.series[symbol]['timestamps'])
+            values[rows, j] = self.series[symbol]['returns']
+            present[rows, j] = 1.0
+
+        # مجموع‌ها فقط روی سطرهایی که هر دو نماد داده دارند (همبستگی جفتی)
+        x, mx = values[:, dirty], present[:, dirty]
+        n = mx.T @ present
+        sx = x.T @ present
+        sy = mx.T @ values
+        sxx = (x * x).T @ present
+        syy = mx.T @ (values * values)
+        sxy = x.T @ values
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = sxy - sx * sy / n
+            var_x = sxx - sx * sx / n
+            var_y = syy - sy * sy / n
+            corr = cov / np.sqrt(var_x * var_y)
+        corr[(n < self.settings['min_periods']) | (var_x <= 0) | (var_y <= 0)] = np.nan
+        corr = np.clip(corr, -1.0, 1.0)
+
+        self._matrix[dirty, :] = corr
+        self._matrix[:, dirty] = corr.T
+        self._matrix[dirty, dirty] = 1.0
+        return self._symbols, self._matrix
+
+    def correlation(self, a, b):
+        """Return correlation of two symbols, NaN when unknown"""
+        self.matrix()
+        if a not in self._index or b not in self._index:
+            return np.nan
+        return float(self._matrix[self._index[a], self._index[b]])
+
+def collapse_correlated(signals, cache, threshold=None, sent=()):
+    """Keep the top-scoring signal of each cluster of correlated same-direction signals.
+
+    Signals are visited by descending score; each joins the first leader of
+    the same type whose symbol correlates above ``threshold``, otherwise it
+    starts a new cluster. Signals in ``sent`` (already delivered earlier in
+    the scan) lead clusters first, so later correlated signals are dropped in
+    their favour. Kept signals list the collapsed symbols in their reasons.
+    Returns (kept, collapsed) in the input order.
+    """
+    threshold = cache.settings['threshold'] if threshold is None else threshold
+    # رهبر هر خوشه همراه با اعضایش؛ سیگنال‌های ارسال‌شده عضو گزارش‌شدنی ندارند
+    leaders = [(signal, None) for signal in sent]
+    clusters = {}
+    for index in sorted(range(len(signals)), key=lambda i: signals[i]['score'], reverse=True):
+        signal = signals[index]
+        for leader_signal, members in leaders:
+            if (leader_signal['type'] == signal['type']
+                    and cache.correlation(leader_signal['symbol'], signal['symbol']) >= threshold):
+                if members is not None:
+                    members.append(index)
+                break
+        else:
+            clusters[index] = []
+            leaders.append((signal, clusters[index]))
+
+    kept, collapsed = [], []
+    for index, signal in enumerate(signals):
+        if index not in clusters:
+            collapsed.append(signal)
+            continue
+        members = clusters[index]
+        if members:
+            names = ", ".join(f"{signals[i]['symbol']} ({signals[i]['score']})" for i in members)
+            signal['reasons'] += f"\n🔗 Correlated {signal['type']} signals collapsed: {names}"
+        kept.append(signal)
+    return kept, collapsed
@@ -2,17 +2,18 @@ from datetime import datetime
 import pytz
 from config import SCALPING_SETTINGS
 
+FACTOR_WEIGHTS = {
+    'rsi': 25, 'ema': 20, 'macd': 20, 'bb': 15,
+    'volume': 10, 'support': 10, 'resistance': 10,
+    'price_action': 10, 'higher_tf': 10
+}
+
 def calculate_score(buy_factors, sell_factors, atr, current_price):
     """Calculate signal score with balanced weighting"""
     max_score = 100
     score = 0
-    weights = {
-        'rsi': 25, 'ema': 20, 'macd': 20, 'bb': 15,
-        'volume': 10, 'support': 10, 'resistance': 10,
-        'price_action': 10, 'higher_tf': 10
-    }
     for factor in buy_factors | sell_factors:
-        score += weights.get(factor, 0)
+        score += FACTOR_WEIGHTS.get(factor, 0)
     # Adjust score based on volatility (ATR)
     volatility_factor = max(0.6, min(1.0, 1.0 - (atr / current_price)))
     return min(int(score * volatility_factor), max_score)
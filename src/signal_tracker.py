@@ -7,53 +7,61 @@ import pytz
 import pandas as pd
 from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-from filelock import FileLock
-from config import SIGNALS_FILE, KUCOIN_BASE_URL, KUCOIN_KLINE_ENDPOINT, KUCOIN_TICKER_ENDPOINT
+from config import SIGNALS_FILE, TRACKER_TIMEFRAME
 from telegram_sender import send_telegram_message
+from market_cache import get_cache, INTERVAL_SECONDS
+from market_data import get_client, request_kline_rows
+from state_store import signal_snapshot
+import kernels
 
 def load_signals():
-    """Load signals from JSON file with proper timezone handling"""
+    """Load signals from the state snapshot (or legacy JSON file) with proper timezone handling"""
     try:
-        if os.path.exists(SIGNALS_FILE):
+        signals = signal_snapshot.load()
+        source = signal_snapshot.path
+        if signals is None and os.path.exists(SIGNALS_FILE):
+            # فایل JSON قدیمی تا اولین ذخیره که به اسنپ‌شات منتقل می‌شود
             with open(SIGNALS_FILE, 'r') as f:
                 content = f.read()
                 signals = json.loads(content) if content.strip() else []
-                print(f"Loaded {len(signals)} signals from {SIGNALS_FILE}")
-                tehran_tz = pytz.timezone('Asia/Tehran')
-                for signal in signals:
-                    # Ensure valid status
-                    if 'status' not in signal or signal['status'] not in ['active', 'target_reached', 'stop_loss']:
-                        print(f"Fixing invalid status for {signal.get('symbol', 'unknown')}")
-                        signal['status'] = 'active'
-                    # Ensure created_at is timezone-aware
-                    if 'created_at' not in signal:
-                        signal['created_at'] = datetime.now(tehran_tz).isoformat()
-                    else:
-                        try:
-                            created_at = datetime.fromisoformat(signal['created_at'])
-                            if created_at.tzinfo is None:
-                                created_at = tehran_tz.localize(created_at)
-                                signal['created_at'] = created_at.isoformat()
-                        except ValueError:
-                            created_at = datetime.strptime(signal['created_at'], "%Y-%m-%d %H:%M:%S")
+            source = SIGNALS_FILE
+        if signals is not None:
+            print(f"Loaded {len(signals)} signals from {source}")
+            tehran_tz = pytz.timezone('Asia/Tehran')
+            for signal in signals:
+                # Ensure valid status
+                if 'status' not in signal or signal['status'] not in ['active', 'target_reached', 'stop_loss']:
+                    print(f"Fixing invalid status for {signal.get('symbol', 'unknown')}")
+                    signal['status'] = 'active'
+                # Ensure created_at is timezone-aware
+                if 'created_at' not in signal:
+                    signal['created_at'] = datetime.now(tehran_tz).isoformat()
+                else:
+                    try:
+                        created_at = datetime.fromisoformat(signal['created_at'])
+                        if created_at.tzinfo is None:
                             created_at = tehran_tz.localize(created_at)
                             signal['created_at'] = created_at.isoformat()
-                    # Handle closed_at if present
-                    if 'closed_at' in signal and signal['closed_at']:
+                    except ValueError:
+                        created_at = datetime.strptime(signal['created_at'], "%Y-%m-%d %H:%M:%S")
+                        created_at = tehran_tz.localize(created_at)
+                        signal['created_at'] = created_at.isoformat()
+                # Handle closed_at if present
+                if 'closed_at' in signal and signal['closed_at']:
+                    try:
+                        closed_at = datetime.fromisoformat(signal['closed_at'])
+                        if closed_at.tzinfo is None:
+                            closed_at = tehran_tz.localize(closed_at)
+                            signal['closed_at'] = closed_at.isoformat()
+                    except ValueError:
                         try:
-                            closed_at = datetime.fromisoformat(signal['closed_at'])
-                            if closed_at.tzinfo is None:
-                                closed_at = tehran_tz.localize(closed_at)
-                                signal['closed_at'] = closed_at.isoformat()
+                            closed_at = datetime.strptime(signal['closed_at'], "%Y-%m-%d %H:%M:%S")
+                            closed_at = tehran_tz.localize(closed_at)
+                            signal['closed_at'] = closed_at.isoformat()
                         except ValueError:
-                            try:
-                                closed_at = datetime.strptime(signal['closed_at'], "%Y-%m-%d %H:%M:%S")
-                                closed_at = tehran_tz.localize(closed_at)
-                                signal['closed_at'] = closed_at.isoformat()
-                            except ValueError:
-                                signal['closed_at'] = None
-                return signals
-        print(f"No signals found at {SIGNALS_FILE}")
+                            signal['closed_at'] = None
+            return signals
+        print(f"No signals found at {signal_snapshot.path} or {SIGNALS_FILE}")
         return []
     except json.JSONDecodeError as e:
         print(f"Error decoding JSON from {SIGNALS_FILE}: {e}")
@@ -63,14 +71,10 @@ def load_signals():
         return []
 
 def save_signals(signals):
-    """Save signals to JSON file with proper timezone handling"""
-    lock = FileLock(f"{SIGNALS_FILE}.lock")
+    """Save signals to the state snapshot, appending only changed signals"""
     try:
-        with lock:
-            os.makedirs(os.path.dirname(SIGNALS_FILE), exist_ok=True)
-            with open(SIGNALS_FILE, 'w') as f:
-                json.dump(signals, f, indent=2)
-            print(f"Saved {len(signals)} signals to {SIGNALS_FILE}")
+        changed = signal_snapshot.save(signals)
+        print(f"Saved {len(signals)} signals ({changed} changed) to {signal_snapshot.path}")
     except Exception as e:
         print(f"Error saving signals: {e}")
         send_telegram_message(f"❌ Error saving signals: {e}")
@@ -92,50 +96,37 @@ def save_signal(signal):
 
 def fetch_kline_data(symbol, start_time, end_time, interval="30min"):
     """Fetch kline data from KuCoin for a specific time range"""
-    url = f"{KUCOIN_BASE_URL}{KUCOIN_KLINE_ENDPOINT}"
-    params = {
-        "symbol": symbol,
-        "type": interval,
-        "startAt": int(start_time.timestamp()),
-        "endAt": int(end_time.timestamp())
-    }
-    try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        if not data.get('data'):
-            print(f"No kline data for {symbol}: {data}")
-            return None
-        df = pd.DataFrame(data['data'], columns=[
-            "timestamp", "open", "close", "high", "low", "volume", "turnover"
-        ])
-        df = df[["timestamp", "open", "high", "low", "close", "volume"]]
-        df = df.astype(float)
-        df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s").dt.tz_localize('UTC').dt.tz_convert('Asia/Tehran')
-        df = df.iloc[::-1].reset_index(drop=True)
-        print(f"Received {len(df)} candles for {symbol} from {start_time} to {end_time}")
-        return df
-    except Exception as e:
-        print(f"Error fetching kline data for {symbol}: {e}")
+    rows = get_cache().candles(
+        symbol, interval, int(start_time.timestamp()), int(end_time.timestamp()),
+        lambda start, end: request_kline_rows(symbol, interval, start, end)
+    )
+    if not rows:
+        return None
+    df = pd.DataFrame(rows, columns=[
+        "timestamp", "open", "close", "high", "low", "volume", "turnover"
+    ])
+    df = df[["timestamp", "open", "high", "low", "close", "volume"]]
+    df = df.astype(float)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s").dt.tz_localize('UTC').dt.tz_convert('Asia/Tehran')
+    df = df.iloc[::-1].reset_index(drop=True)
+    print(f"Received {len(df)} candles for {symbol} from {start_time} to {end_time}")
+    return df
+
+def request_current_price(symbol):
+    """Request level-1 ticker price from the market data providers"""
+    price = get_client().ticker(symbol)
+    if not price:
+        print(f"No price data for {symbol}")
         return None
+    return price
 
 def get_current_price(symbol):
     """Fetch current price from KuCoin"""
-    url = f"{KUCOIN_BASE_URL}{KUCOIN_TICKER_ENDPOINT}"
-    params = {"symbol": symbol}
-    try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        price = data.get('data', {}).get('price')
-        if price:
-            print(f"Current price for {symbol}: {price}")
-            return float(price)
-        print(f"No price data for {symbol}: {data}")
-        return None
-    except Exception as e:
-        print(f"Error fetching price for {symbol}: {e}")
-        return None
+    price = get_cache().get_or_fetch('ticker', {"symbol": symbol}, lambda: request_current_price(symbol))
+    if price:
+        print(f"Current price for {symbol}: {price}")
+        return float(price)
+    return None
 
 def calculate_profit_loss(signal, close_price):
     """Calculate profit/loss percentage"""
@@ -172,38 +163,59 @@ def calculate_duration(created_at, closed_at):
         print(f"Error calculating duration: {e}")
         return None
 
-def check_signal_hit(signal, df):
-    """Check if signal hit target or stop-loss based on kline data"""
+def check_signal_hit(signal, df, now=None):
+    """Check if signal hit target or stop-loss on candles after its checkpoint.
+
+    Only candles newer than ``checked_until`` (or ``created_at``) are
+    evaluated. The running max favorable/adverse excursion (percent of entry)
+    is updated on the signal, and ``checked_until`` advances over candles
+    that were already closed at ``now``.
+    """
     try:
         target_price = float(signal['target_price'])
         stop_loss = float(signal['stop_loss'])
+        entry_price = float(signal.get('entry_price', signal['current_price']))
         signal_type = signal['type']
-        created_at = datetime.fromisoformat(signal['created_at']).astimezone(pytz.timezone('Asia/Tehran'))
-
-        for _, row in df.iterrows():
-            candle_time = row['timestamp']
-            if candle_time <= created_at:
-                continue  # Skip candles before signal creation
-            high = row['high']
-            low = row['low']
-            
-            if signal_type == 'BUY':
-                if high >= target_price:
-                    return 'target_reached', str(row['close']), candle_time.isoformat()
-                if low <= stop_loss:
-                    return 'stop_loss', str(row['close']), candle_time.isoformat()
-            elif signal_type == 'SELL':
-                if low <= target_price:
-                    return 'target_reached', str(row['close']), candle_time.isoformat()
-                if high >= stop_loss:
-                    return 'stop_loss', str(row['close']), candle_time.isoformat()
+        tehran_tz = pytz.timezone('Asia/Tehran')
+        now = now or datetime.now(tehran_tz)
+        checkpoint = signal.get('checked_until') or signal['created_at']
+        checkpoint = datetime.fromisoformat(checkpoint).astimezone(tehran_tz)
+        candle_length = timedelta(seconds=INTERVAL_SECONDS[TRACKER_TIMEFRAME])
+        mfe = signal.get('max_favorable_excursion', 0.0)
+        mae = signal.get('max_adverse_excursion', 0.0)
+
+        pending = df[df['timestamp'] > checkpoint]  # Skip candles already evaluated or before signal creation
+        if pending.empty:
+            return None, None, None
+        highs = pending['high'].to_numpy(dtype=float)
+        lows = pending['low'].to_numpy(dtype=float)
+        hit_index, hit_kind = kernels.first_hit(highs, lows, target_price, stop_loss, signal_type == 'BUY')
+        end = len(pending) if hit_index < 0 else hit_index + 1
+
+        if signal_type == 'BUY':
+            mfe = max(mfe, (highs[:end].max() - entry_price) / entry_price * 100)
+            mae = max(mae, (entry_price - lows[:end].min()) / entry_price * 100)
+        else:
+            mfe = max(mfe, (entry_price - lows[:end].min()) / entry_price * 100)
+            mae = max(mae, (highs[:end].max() - entry_price) / entry_price * 100)
+        signal['max_favorable_excursion'] = float(mfe)
+        signal['max_adverse_excursion'] = float(mae)
+
+        if hit_index >= 0:
+            row = pending.iloc[hit_index]
+            status = 'target_reached' if hit_kind == 1 else 'stop_loss'
+            return status, str(row['close']), row['timestamp'].isoformat()
+
+        closed = pending[pending['timestamp'] + candle_length <= now]
+        if not closed.empty:
+            signal['checked_until'] = closed['timestamp'].iloc[-1].isoformat()
         return None, None, None
     except Exception as e:
         print(f"Error checking signal hit for {signal['symbol']}: {e}")
         return None, None, None
 
 def update_signal_status():
-    """Update signal statuses by checking historical kline data"""
+    """Update signal statuses by checking only candles after each signal's checkpoint"""
     signals = load_signals()
     if not signals:
         print("No signals to update")
@@ -219,14 +231,21 @@ def update_signal_status():
             continue
 
         try:
-            created_at = datetime.fromisoformat(signal['created_at']).astimezone(tehran_tz)
-            # Fetch kline data from signal creation to now
-            df = fetch_kline_data(signal['symbol'], created_at, now, interval="30min")
+            checkpoint = signal.get('checked_until') or signal['created_at']
+            start_time = datetime.fromisoformat(checkpoint).astimezone(tehran_tz)
+            # Fetch kline data from the last evaluated candle to now
+            df = fetch_kline_data(signal['symbol'], start_time, now, interval=TRACKER_TIMEFRAME)
             if df is None:
                 print(f"Skipping update for {signal['symbol']} due to missing kline data")
                 continue
 
-            status, closed_price, closed_at = check_signal_hit(signal, df)
+            cursor_before = (signal.get('checked_until'), signal.get('max_favorable_excursion'),
+                             signal.get('max_adverse_excursion'))
+            status, closed_price, closed_at = check_signal_hit(signal, df, now)
+            cursor_after = (signal.get('checked_until'), signal.get('max_favorable_excursion'),
+                            signal.get('max_adverse_excursion'))
+            if cursor_after != cursor_before:
+                updated = True
             if status:
                 signal['status'] = status
                 signal['closed_price'] = closed_price
@@ -237,6 +256,7 @@ def update_signal_status():
                     f"📢 Signal Update for {signal['symbol']}\n"
                     f"Status: {status.replace('_', ' ').title()}\n"
                     f"Closed Price: {closed_price}\n"
+                    f"MFE/MAE: {signal['max_favorable_excursion']:.2f}% / {signal['max_adverse_excursion']:.2f}%\n"
                     f"Time: {closed_at}"
                 )
         except Exception as e:
@@ -309,6 +329,8 @@ def generate_excel_report():
             'Closed_At': signal.get('closed_at'),
             'Profit_Loss_%': round(profit_loss, 2) if profit_loss is not None else None,
             'Duration_Hours': round(duration, 2) if duration is not None else None,
+            'MFE_%': round(signal['max_favorable_excursion'], 2) if 'max_favorable_excursion' in signal else None,
+            'MAE_%': round(signal['max_adverse_excursion'], 2) if 'max_adverse_excursion' in signal else None,
             'Reasons': signal['reasons'].replace('✅ ', '').replace('\n', '; ')
         }
         all_signals_data.append(signal_row)
@@ -351,7 +373,7 @@ def generate_excel_report():
     ws1 = wb.active
     ws1.title = "All Signals"
     headers = ['Symbol', 'Type', 'Entry Price', 'Target Price', 'Stop Loss', 'Created At', 
-               'Status', 'Closed Price', 'Closed At', 'Profit/Loss (%)', 'Duration (Hours)', 'Reasons']
+               'Status', 'Closed Price', 'Closed At', 'Profit/Loss (%)', 'Duration (Hours)', 'MFE %', 'MAE %', 'Reasons']
     ws1.append(headers)
     for row in all_signals_data:
         ws1.append([row.get(h.replace(' ', '_'), '') for h in headers])
@@ -432,6 +454,8 @@ if __name__ == "__main__":
             generate_excel_report()
         else:
             update_signal_status()
+        print(f"Market cache: {get_cache().summary()}")
+        print(f"Market data: {get_client().summary()}")
     except Exception as e:
         print(f"Error in main execution: {e}")
         send_telegram_message(f"❌ System error in reporting: {e}")
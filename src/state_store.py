@@ -0,0 +1,214 @@
+import json
+import os
+import time
+import zlib
+import gzip
+import argparse
+from collections import Counter, OrderedDict
+from filelock import FileLock
+from config import (SIGNALS_FILE, SCAN_STATE_FILE, SIGNALS_STATE_FILE, SCAN_STATE_SNAPSHOT_FILE,
+                    STATE_SETTINGS)
+
+def _encode(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+# ----- Record layouts: how each state object maps to keyed records -----
+
+def _flatten_signals(signals):
+    """Signal list -> ordered records keyed by symbol|type|created_at"""
+    records = OrderedDict()
+    seen = Counter()
+    for signal in signals:
+        key = f"{signal.get('symbol')}|{signal.get('type')}|{signal.get('created_at')}"
+        seen[key] += 1
+        # کلید تکراری با شماره تکرار یکتا می‌شود تا تبدیل بدون اتلاف بماند
+        records[key if seen[key] == 1 else f"{key}#{seen[key]}"] = signal
+    return records
+
+def _unflatten_signals(records):
+    return list(records.values())
+
+def _flatten_scan_state(state):
+    """Scan state dict -> one record per symbol plus one per top-level key"""
+    records = OrderedDict()
+    for key, value in state.items():
+        if key == 'symbols' and isinstance(value, dict):
+            records['@symbols'] = None  # محل کلید symbols در ترتیب کلیدها
+            for symbol, entry in value.items():
+                records[f"symbols/{symbol}"] = entry
+        else:
+            records[f"meta/{key}"] = value
+    return records
+
+def _unflatten_scan_state(records):
+    state = {}
+    for key, value in records.items():
+        if key == '@symbols':
+            state['symbols'] = {}
+        elif key.startswith('symbols/'):
+            state.setdefault('symbols', {})[key[len('symbols/'):]] = value
+        else:
+            state[key[len('meta/'):]] = value
+    return state
+
+# ----- Snapshot file -----
+
+def _read_members(data):
+    """Decompress concatenated gzip members, stopping at a torn trailing member"""
+    chunks = []
+    complete = True
+    while data:
+        decompressor = zlib.decompressobj(wbits=31)
+        try:
+            chunk = decompressor.decompress(data) + decompressor.flush()
+        except zlib.error:
+            complete = False
+            break
+        if not decompressor.eof:
+            complete = False
+            break
+        chunks.append(chunk)
+        data = decompressor.unused_data
+    return chunks, complete
+
+class StateSnapshot:
+    """Compressed base snapshot followed by append-only delta segments.
+
+    The file is a sequence of gzip members holding JSON lines: the first
+    member is the base (one ``put`` per record) and each save appends one
+    member with only the records that changed (``put``/``del``). Loading is a
+    single sequential read. The file is rewritten as a fresh base when there
+    are too many segments, the deltas outgrow the base, or record order
+    could not be kept by appending.
+    """
+
+    def __init__(self, path, flatten, unflatten, settings=None):
+        self.path = path
+        self.flatten = flatten
+        self.unflatten = unflatten
+        self.settings = dict(STATE_SETTINGS, **(settings or {}))
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _read(self):
+        """Records, segment count, (base bytes, delta bytes) and whether the file was intact"""
+        with open(self.path, 'rb') as f:
+            chunks, complete = _read_members(f.read())
+        if not complete:
+            print(f"Ignoring torn trailing segment in {self.path}")
+        records = OrderedDict()
+        segments = 0
+        for index, chunk in enumerate(chunks):
+            for line in chunk.splitlines():
+                op = json.loads(line)
+                if op[0] == 'put':
+                    records[op[1]] = op[2]
+                elif op[0] == 'del':
+                    records.pop(op[1], None)
+            segments += index > 0
+        sizes = (len(chunks[0]) if chunks else 0, sum(len(c) for c in chunks[1:]))
+        return records, segments, sizes, complete
+
+    def load(self):
+        """State object from the snapshot, or None when there is no snapshot"""
+        if not self.exists():
+            return None
+        records, _, _, _ = self._read()
+        return self.unflatten(records)
+
+    def _write_base(self, encoded):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        lines = "".join(f'["put",{_encode(key)},{value}]\n' for key, value in encoded.items())
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(gzip.compress(lines.encode('utf-8'), compresslevel=9, mtime=0))
+        os.replace(tmp_path, self.path)
+
+    def save(self, state):
+        """Append the changes since the stored state; returns the number of changed records"""
+        encoded = OrderedDict((key, _encode(value)) for key, value in self.flatten(state).items())
+        with FileLock(f"{self.path}.lock"):
+            if not self.exists():
+                self._write_base(encoded)
+                return len(encoded)
+            records, segments, (base_size, delta_size), complete = self._read()
+            stored = OrderedDict((key, _encode(value)) for key, value in records.items())
+
+            ops = [f'["del",{_encode(key)}]\n' for key in stored if key not in encoded]
+            ops += [f'["put",{_encode(key)},{value}]\n' for key, value in encoded.items()
+                    if stored.get(key) != value]
+            # ترتیب پس از اعمال تغییرات: کلیدهای موجود سر جای خود، کلیدهای جدید در انتها
+            order = [key for key in stored if key in encoded] + [key for key in encoded if key not in stored]
+            delta = "".join(ops).encode('utf-8')
+
+            if (not complete or order != list(encoded)
+                    or segments + 1 > self.settings['max_segments']
+                    or delta_size + len(delta) > self.settings['max_delta_ratio'] * max(base_size, 1)):
+                self._write_base(encoded)
+            elif ops:
+                with open(self.path, 'ab') as f:
+                    f.write(gzip.compress(delta, mtime=0))
+                    f.flush()
+                    os.fsync(f.fileno())
+            return len(ops)
+
+    def compact(self):
+        """Rewrite the snapshot as a single base member"""
+        with FileLock(f"{self.path}.lock"):
+            records, _, _, _ = self._read()
+            self._write_base(OrderedDict((key, _encode(value)) for key, value in records.items()))
+
+signal_snapshot = StateSnapshot(SIGNALS_STATE_FILE, _flatten_signals, _unflatten_signals)
+scan_state_snapshot = StateSnapshot(SCAN_STATE_SNAPSHOT_FILE, _flatten_scan_state, _unflatten_scan_state)
+
+SNAPSHOTS = {
+    'signals': (signal_snapshot, SIGNALS_FILE),
+    'scan_state': (scan_state_snapshot, SCAN_STATE_FILE),
+}
+
+# ----- Lossless conversion to and from the JSON files -----
+
+def import_json(name, json_path=None):
+    """Replace a snapshot with the contents of its JSON file"""
+    snapshot, default_path = SNAPSHOTS[name]
+    with open(json_path or default_path, 'r') as f:
+        state = json.load(f)
+    with FileLock(f"{snapshot.path}.lock"):
+        snapshot._write_base(OrderedDict((key, _encode(value)) for key, value in snapshot.flatten(state).items()))
+    print(f"Imported {json_path or default_path} into {snapshot.path}")
+    return state
+
+def export_json(name, json_path=None):
+    """Write a snapshot back out in the original pretty-printed JSON layout"""
+    snapshot, default_path = SNAPSHOTS[name]
+    state = snapshot.load()
+    if state is None:
+        raise FileNotFoundError(f"No snapshot at {snapshot.path}")
+    path = json_path or default_path
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(state, f, indent=2)
+    print(f"Exported {snapshot.path} to {path}")
+    return state
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert and maintain compressed state snapshots')
+    parser.add_argument('action', choices=['import', 'export', 'compact', 'info'])
+    parser.add_argument('name', choices=sorted(SNAPSHOTS))
+    parser.add_argument('--json', help='JSON file path (default: the legacy file in data/)')
+    args = parser.parse_args()
+
+    if args.action == 'import':
+        import_json(args.name, args.json)
+    elif args.action == 'export':
+        export_json(args.name, args.json)
+    elif args.action == 'compact':
+        SNAPSHOTS[args.name][0].compact()
+    else:
+        snapshot = SNAPSHOTS[args.name][0]
+        started = time.perf_counter()
+        records, segments, (base_size, delta_size), complete = snapshot._read()
+        print(f"{snapshot.path}: {len(records)} records, {segments} delta segments, "
+              f"{os.path.getsize(snapshot.path)} bytes on disk ({base_size} + {delta_size} uncompressed), "
+              f"{'intact' if complete else 'torn tail'}, read in {(time.perf_counter() - started) * 1000:.1f}ms")
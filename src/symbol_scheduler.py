@@ -0,0 +1,134 @@
+import json
+import math
+import os
+import time
+from config import SCAN_STATE_FILE, SCHEDULER_SETTINGS, PRIMARY_TIMEFRAME
+from market_cache import INTERVAL_SECONDS
+from state_store import scan_state_snapshot
+
+def load_scan_state():
+    """Load scheduler state (per-symbol metrics and last scan info)"""
+    try:
+        state = scan_state_snapshot.load()
+        if state is None and os.path.exists(SCAN_STATE_FILE):
+            # فایل JSON قدیمی تا اولین ذخیره که به اسنپ‌شات منتقل می‌شود
+            with open(SCAN_STATE_FILE, 'r') as f:
+                content = f.read()
+                state = json.loads(content) if content.strip() else {}
+        if state is not None:
+            state.setdefault('symbols', {})
+            return state
+    except Exception as e:
+        print(f"Error loading scan state: {e}")
+    return {'symbols': {}}
+
+def save_scan_state(state):
+    """Save scheduler state to its snapshot, appending only changed symbols"""
+    try:
+        changed = scan_state_snapshot.save(state)
+        print(f"Saved scan state for {len(state['symbols'])} symbols ({changed} changed) to {scan_state_snapshot.path}")
+    except Exception as e:
+        print(f"Error saving scan state: {e}")
+
+def signal_hit_rates(signals):
+    """Smoothed target hit rate per symbol from closed signals"""
+    counts = {}
+    for signal in signals:
+        if signal.get('status') not in ('target_reached', 'stop_loss'):
+            continue
+        wins, total = counts.get(signal['symbol'], (0, 0))
+        counts[signal['symbol']] = (wins + (signal['status'] == 'target_reached'), total + 1)
+    # هموارسازی لاپلاس تا نمادهای با سابقه کم به ۰ یا ۱ نچسبند
+    return {symbol: (wins + 1) / (total + 2) for symbol, (wins, total) in counts.items()}
+
+def extract_metrics(df):
+    """Cheap per-symbol activity metrics from the last prepared candle"""
+    return metrics_from_row(df.iloc[-1])
+
+def metrics_from_row(row):
+    """Activity metrics from one indicator row (prepared frame row or rolled-forward dict)"""
+    price = float(row['close'])
+    if not price:
+        return None
+    levels = [row['bb_lower'], row['bb_upper'], row['support'], row['resistance']]
+    distances = [abs(price - float(level)) / price for level in levels if not math.isnan(level)]
+    volume_change = float(row['volume_change'])
+    atr = float(row['atr'])
+    return {
+        'volatility': 0.0 if math.isnan(atr) else atr / price,
+        'volume_change': 0.0 if math.isnan(volume_change) or math.isinf(volume_change) else volume_change,
+        'level_distance': min(distances) if distances else 1.0,
+    }
+
+def priority_score(metrics, hit_rate=None):
+    """Weighted 0..1 priority; symbols without metrics are scanned first"""
+    if metrics is None:
+        return float('inf')
+    if metrics.get('low_volume'):
+        return 0.0
+    weights = SCHEDULER_SETTINGS['weights']
+    volatility = min(metrics['volatility'] / SCHEDULER_SETTINGS['volatility_scale'], 1.0)
+    volume = min(max(metrics['volume_change'], 0.0) / SCHEDULER_SETTINGS['volume_change_scale'], 1.0)
+    proximity = 1.0 - min(metrics['level_distance'] / SCHEDULER_SETTINGS['level_distance_scale'], 1.0)
+    hit = 0.5 if hit_rate is None else hit_rate
+    return (weights['volatility'] * volatility + weights['volume'] * volume
+            + weights['proximity'] * proximity + weights['hit_rate'] * hit)
+
+def plan_scan(symbols, state, signals, now=None):
+    """Order symbols by priority and drop those not due this candle.
+
+    The top ``hot_fraction`` is scanned every run, the next ``warm_fraction``
+    every ``warm_every`` candles and the rest every ``cold_every`` candles.
+    Returns (due symbols in priority order, deferred symbols).
+    """
+    now = time.time() if now is None else now
+    candle_seconds = INTERVAL_SECONDS[PRIMARY_TIMEFRAME]
+    rates = signal_hit_rates(signals)
+    ranked = []
+    for symbol in symbols:
+        entry = state['symbols'].get(symbol, {})
+        ranked.append((symbol, priority_score(entry.get('metrics'), rates.get(symbol))))
+    ranked.sort(key=lambda item: item[1], reverse=True)
+
+    hot_cut = math.ceil(len(ranked) * SCHEDULER_SETTINGS['hot_fraction'])
+    warm_cut = hot_cut + math.ceil(len(ranked) * SCHEDULER_SETTINGS['warm_fraction'])
+    due, deferred = [], []
+    for rank, (symbol, priority) in enumerate(ranked):
+        if rank < hot_cut:
+            every = 1
+        elif rank < warm_cut:
+            every = SCHEDULER_SETTINGS['warm_every']
+        else:
+            every = SCHEDULER_SETTINGS['cold_every']
+        last_scanned = state['symbols'].get(symbol, {}).get('last_scanned', 0)
+        # نیم کندل تلورانس برای تاخیر زمان‌بندی گیت‌هاب
+        if now - last_scanned >= (every - 0.5) * candle_seconds:
+            due.append(symbol)
+        else:
+            deferred.append(symbol)
+    print(f"Scan plan: {len(due)} due, {len(deferred)} deferred")
+    return due, deferred
+
+def mark_scanned(state, symbol, metrics=None, low_volume=False, prune_state=None, now=None):
+    """Record that a symbol was scanned, optionally with fresh metrics"""
+    entry = state['symbols'].setdefault(symbol, {})
+    entry['last_scanned'] = time.time() if now is None else now
+    if low_volume:
+        entry['metrics'] = {'low_volume': True}
+    elif metrics is not None:
+        entry['metrics'] = metrics
+    if prune_state is not None:
+        entry['prune_state'] = prune_state
+
+def record_scan(state, started_at, scanned, deferred, skipped, pruned=None):
+    """Store metadata about the finished scan, including deadline skips"""
+    state['last_scan'] = {
+        'started_at': started_at,
+        'duration_seconds': round(time.time() - started_at, 1),
+        'budget_seconds': SCHEDULER_SETTINGS['scan_budget_seconds'],
+        'scanned': scanned,
+        'deferred': deferred,
+        'skipped': skipped,
+        'pruned': pruned or [],
+        'kline_requests_saved': len(pruned or []),
+    }